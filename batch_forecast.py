@@ -0,0 +1,123 @@
+# Batched forecasts: fit the same kind of model to every row of a (series x months) matrix at once, e.g. the monthly
+# means of every branch as returned by DrabStore.level_aggregate. All series share the same months, so the models are
+# fitted with array operations across all rows instead of one fit per series. Missing values (NaN) are skipped.
+#
+# Every forecaster returns the mean of the forecast and the upper and lower bounds of its 80% prediction interval, as
+# (series x look_ahead) arrays. Series without enough data to fit the model get NaN forecasts.
+from __future__ import division
+
+import itertools
+
+import numpy as np
+from scipy import stats
+
+# Quantile of the standard normal distribution for two-sided 80% intervals
+z_80 = stats.norm.ppf(0.9)
+
+
+# Least-squares line through every row of Y (series x months) against the month index, ignoring NaNs. Returns the
+# slope, intercept, number of values, mean month index, sum of squared deviations of the month index and residual sum
+# of squares of every row, as 1-d arrays.
+def linear_fit(Y):
+    Y = np.asarray(Y, dtype=np.float64)
+    valid = ~np.isnan(Y)
+    w = valid.astype(np.float64)
+    y = np.where(valid, Y, 0.)
+    t = np.arange(Y.shape[1], dtype=np.float64)
+
+    with np.errstate(invalid='ignore', divide='ignore'):
+        n = w.sum(axis=1)
+        t_mean = w.dot(t) / n
+        y_mean = y.sum(axis=1) / n
+        dt = (t[None, :] - t_mean[:, None]) * w
+        sxx = (dt ** 2).sum(axis=1)
+        slope = (dt * y).sum(axis=1) / sxx
+        intercept = y_mean - slope * t_mean
+        residuals = (y - intercept[:, None] - slope[:, None] * t[None, :]) * w
+        rss = (residuals ** 2).sum(axis=1)
+    return slope, intercept, n, t_mean, sxx, rss
+
+
+# Forecast of every row of Y by extrapolating its least-squares line (the trend of linear_prediction), with the
+# prediction interval of the regression
+def trend_forecast(Y, look_ahead):
+    slope, intercept, n, t_mean, sxx, rss = linear_fit(Y)
+    t = Y.shape[1] + np.arange(look_ahead, dtype=np.float64)
+    mean = intercept[:, None] + slope[:, None] * t[None, :]
+
+    with np.errstate(invalid='ignore', divide='ignore'):
+        dof = np.where(n > 2, n - 2, np.nan)
+        se = np.sqrt(rss / dof)[:, None] * np.sqrt(1 + 1 / n[:, None] + (t[None, :] - t_mean[:, None]) ** 2 /
+                                                   sxx[:, None])
+        half_width = stats.t.ppf(0.9, dof)[:, None] * se
+    mean[n < 3] = np.nan  # No prediction interval without residual degrees of freedom
+    return mean, mean + half_width, mean - half_width
+
+
+# Additive Holt-Winters (ETS(A,A,A), or ETS(A,A,N) for series shorter than two seasons) fitted to every row of Y.
+# The smoothing parameters are chosen for every row separately, by a grid search for the lowest sum of squared
+# one-step errors: all rows are run through the recursions for all parameter combinations at once. The states are
+# initialized from the least-squares trend and the mean detrended value of every month of the season.
+# Prediction intervals use the analytic forecast variance of the additive model.
+def holt_winters_forecast(Y, look_ahead, period=12,
+                          alphas=(0.1, 0.3, 0.5, 0.7, 0.9), betas=(0., 0.1, 0.3), gammas=(0., 0.1, 0.3)):
+    Y = np.asarray(Y, dtype=np.float64)
+    n_series, n_months = Y.shape
+    valid = ~np.isnan(Y)
+    seasonal = n_months >= 2 * period
+    m = period if seasonal else 1
+
+    # Initial states (before the first month), from the least-squares trend of every series
+    slope, intercept, n, _, _, _ = linear_fit(Y)
+    level0 = intercept - slope
+    trend0 = slope
+    season0 = np.zeros((n_series, m))
+    if seasonal:
+        t = np.arange(n_months)
+        detrended = np.where(valid, Y - intercept[:, None] - slope[:, None] * t[None, :], 0.)
+        counts = np.zeros((n_series, m))
+        for i in range(m):
+            season0[:, i] = detrended[:, i::m].sum(axis=1)
+            counts[:, i] = valid[:, i::m].sum(axis=1)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            season0 = np.where(counts > 0, season0 / counts, 0.)
+        season0 -= season0.mean(axis=1)[:, None]
+
+    # Smoothing parameters in error-correction form: beta and gamma are given as fractions of alpha and 1 - alpha
+    grid = np.array([(a, b * a, g * (1 - a) if seasonal else 0.)
+                     for a, b, g in itertools.product(alphas, betas, gammas if seasonal else (0.,))])
+    alpha, beta, gamma = [grid[:, i][:, None] for i in range(3)]
+
+    # Run every series through the recursions of every parameter combination: states are (combinations x series)
+    level = np.repeat(level0[None, :], len(grid), axis=0)
+    trend = np.repeat(trend0[None, :], len(grid), axis=0)
+    season = np.repeat(season0[None, :, :], len(grid), axis=0)
+    sse = np.zeros(level.shape)
+    for j in range(n_months):
+        s = season[:, :, j % m]
+        error = np.where(valid[:, j], Y[:, j], level + trend + s) - (level + trend + s)
+        sse += error ** 2
+        level, trend = level + trend + alpha * error, trend + beta * error
+        season[:, :, j % m] = s + gamma * error
+
+    # The best parameters and final states of every series
+    best = np.argmin(sse, axis=0)
+    rows = np.arange(n_series)
+    level, trend, season, sse = level[best, rows], trend[best, rows], season[best, rows], sse[best, rows]
+    alpha, beta, gamma = alpha[best, 0], beta[best, 0], gamma[best, 0]
+
+    h = np.arange(1, look_ahead + 1)
+    mean = level[:, None] + h[None, :] * trend[:, None] + season[:, (n_months + h - 1) % m]
+
+    # Forecast variance: sigma^2 * (1 + sum over j < h of c_j^2), with c_j = alpha + j * beta + gamma [j = 0 mod m]
+    with np.errstate(invalid='ignore', divide='ignore'):
+        sigma2 = sse / np.maximum(n - (3 + 2 + m - 1), 1)  # Smoothing parameters and initial states are estimated
+        j = np.arange(1, look_ahead)
+        c = alpha[:, None] + j[None, :] * beta[:, None] + gamma[:, None] * (j % m == 0)[None, :]
+        variance = sigma2[:, None] * (1 + np.concatenate([np.zeros((n_series, 1)), np.cumsum(c ** 2, axis=1)], axis=1))
+    half_width = z_80 * np.sqrt(variance)
+
+    # Series with fewer than 3 values cannot be fitted
+    mean[n < 3] = np.nan
+    return mean, mean + half_width, mean - half_width
+
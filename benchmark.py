@@ -0,0 +1,231 @@
+# Benchmarks of the callback hot paths on synthetic data (see synthetic_data.py), at several data scales:
+#
+#     python benchmark.py --scales small medium --repeat 10 --output benchmark.json
+#
+# Every scale is run in a fresh Python process with MF_DASH_DATA_DIR pointing at its data, so that the data is loaded
+# as it is at server start-up. The callbacks are called through the functions registered with dash, so their timings
+# include the JSON serialization of the response. Memoization is turned off and the scatter result store is disabled,
+# so every call computes its result. The first call of each benchmark (which e.g. computes the Branch level aggregates
+# or a trend index entry) is reported separately from the repeated calls.
+#
+# Results are written as JSON, with the git commit and Python version, so that runs can be compared over time:
+#     {"scales": {"small": {"data": {...}, "results": {"update_graph/branch_trend": {"median_ms": ..., ...}}}}}
+# The synthetic data is kept in --data-dir (default: a directory in the system temp directory) and reused by later runs.
+from __future__ import division
+
+import argparse
+import json
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import timeit
+from collections import OrderedDict
+
+import numpy as np
+
+import synthetic_data
+
+# Data scales: numbers of divisions, regions per division, areas per region, branches per area, variables and months
+scales = OrderedDict([
+    ('small', dict(divisions=4, regions=3, areas=4, branches=5, variables=20, months=69)),  # 240 branches
+    ('medium', dict(divisions=8, regions=5, areas=6, branches=8, variables=40, months=96)),  # 1920 branches
+    ('large', dict(divisions=10, regions=6, areas=8, branches=10, variables=60, months=120)),  # 4800 branches
+])
+
+# Settings of the benchmark processes: every call computes its result, nothing is written outside the data directory
+benchmark_env = {'MF_DASH_MEMOIZE_BACKEND': 'off',
+                 'MF_DASH_RESULT_CACHE_SIZE': '0',
+                 'MF_DASH_RESULT_DIR': '',
+                 'MF_DASH_FORECAST_DIR': '',
+                 'MF_DASH_FORECAST_PROCESSES': '1',
+                 'MF_DASH_INGEST_INTERVAL': '0'}
+
+
+# Size in bytes of the response of a callback (a flask Response) or of a JSON-serializable result, None otherwise
+def _payload_size(value):
+    if hasattr(value, 'get_data'):
+        return len(value.get_data())
+    return None
+
+
+# Time func(*args): the first call, and repeat calls after it
+def _time(func, args, repeat):
+    start = timeit.default_timer()
+    value = func(*args)
+    first = timeit.default_timer() - start
+    times = []
+    for _ in range(repeat):
+        start = timeit.default_timer()
+        value = func(*args)
+        times.append(timeit.default_timer() - start)
+    times = np.array(times) * 1000
+    return OrderedDict([('first_ms', first * 1000),
+                        ('median_ms', np.median(times)),
+                        ('mean_ms', times.mean()),
+                        ('min_ms', times.min()),
+                        ('max_ms', times.max()),
+                        ('repeat', repeat),
+                        ('payload_bytes', _payload_size(value))])
+
+
+# Run the benchmarks in this process, on the data in MF_DASH_DATA_DIR. Returns (data, results).
+def run_benchmarks(repeat):
+    start = timeit.default_timer()
+    import dash_main
+    load_time = timeit.default_timer() - start
+
+    import dataset
+    import forecasting
+    from filter_df import filter_df
+    from timeseries_plot import update_graph, arima_worker
+    from scatter_plot import update_scatter_calc, update_scatter_graph, scatter_key
+    from at_a_glance import update_at_a_glance
+    from layout import compare_value
+    from drab_specifier import update_region, update_area, update_branch
+
+    state = dataset.state
+    tree, store = state.tree, state.store
+    results = OrderedDict()
+    results['load/csv'] = OrderedDict([('first_ms', load_time * 1000)])  # Including the import of all modules
+    results['load/cache'] = _time(dataset.load, (dataset.data_dir, dataset.cache_dir), min(repeat, 3))
+
+    # The selections: the first branch (and the division, region and area it is in), and the areas of its region
+    branch = tree.level_nodes['Branch'][0]
+    division, region, area, branch_name = tree.path[branch]
+    areas = [compare_value(tree.path[node]) for node in tree.children[tree.parent[tree.parent[branch]]][:10]]
+    variable = 'Current Borrowers' if 'Current Borrowers' in store.blocks else store.variables[0]
+    sec_variable = [v for v in store.variables if v != variable][0]
+    n_months = len(store.months)
+    timeframe = [max(n_months - 24, 0), n_months]
+
+    def graph(drab, mean_options=(), forecast_options=(), drab_tabs=1, compare_nodes=()):
+        return update_graph(variable, timeframe, drab[0], drab[1], drab[2], drab[3], list(mean_options),
+                            list(forecast_options), drab_tabs, 'Global', None, None, None, 6, 12, 'ready',
+                            list(compare_nodes))
+
+    branch_drab = [division, region, area, branch_name]
+    division_drab = [division, None, None, None]
+    global_drab = ['Global', None, None, None]
+
+    results['filter_df/global'] = _time(filter_df, ([variable], global_drab, 'mean'), repeat)
+    results['filter_df/division'] = _time(filter_df, ([variable], division_drab, 'mean'), repeat)
+    results['filter_df/branch'] = _time(filter_df, ([variable], branch_drab, 'mean'), repeat)
+    results['filter_df/return_all'] = _time(filter_df, ([variable], [division, region, area, None], 'sum', True),
+                                            repeat)
+
+    results['update_graph/division'] = _time(graph, (division_drab,), repeat)
+    results['update_graph/branch'] = _time(graph, (branch_drab,), repeat)
+    results['update_graph/branch_overlays'] = _time(graph, (branch_drab, ['glbm', 'divm', 'regm', 'arem']), repeat)
+    results['update_graph/branch_trend'] = _time(graph, (branch_drab, (), ['linear_pred']), repeat)
+    results['update_graph/compare_many_trend'] = _time(graph, (branch_drab, (), ['linear_pred'], 3, areas), repeat)
+
+    # Forecasts are fitted in the background: time a fit by itself, and the graph once the forecast is cached
+    y = store.node_aggregate(variable, branch, 'mean')[timeframe[1] - 12:timeframe[1]]
+    results['forecast/fit'] = _time(forecasting.arima_forecast, (y, 6), min(repeat, 3))
+    key = forecasting.forecast_key('arima', branch, variable, timeframe, 12, 6)
+    graph(branch_drab, (), ['arima_pred'])
+    deadline = time.time() + 300
+    while arima_worker.pending(key) and time.time() < deadline:
+        time.sleep(0.1)
+    results['update_graph/branch_forecast'] = _time(graph, (branch_drab, (), ['arima_pred']), repeat)
+
+    for name, drab in [('global', global_drab), ('division', division_drab), ('branch', branch_drab)]:
+        results['update_scatter_calc/' + name] = _time(
+            update_scatter_calc, (variable, sec_variable) + tuple(drab) + (['rsquare', 'quant_trim'],), repeat)
+    key = scatter_key(state, variable, sec_variable, 0, ['rsquare', 'quant_trim'])
+    results['update_scatter_graph/global'] = _time(update_scatter_graph, (key,), repeat)
+
+    results['update_at_a_glance/branch'] = _time(
+        update_at_a_glance, tuple(branch_drab) + (1, 'Global', None, None, None, []), repeat)
+    results['update_at_a_glance/compare_many'] = _time(
+        update_at_a_glance, tuple(branch_drab) + (3, 'Global', None, None, None, areas), repeat)
+
+    results['update_region'] = _time(update_region, (division,), repeat)
+    results['update_area'] = _time(update_area, (region, division), repeat)
+    results['update_branch'] = _time(update_branch, (area, region, division), repeat)
+
+    data = OrderedDict([('branches', len(tree.branch_codes)), ('variables', len(store.variables)),
+                        ('months', n_months), ('data_mb', state.nbytes / 1e6), ('data_version', state.version)])
+    return data, results
+
+
+# The synthetic data of scale in data_dir, generated unless it is already there
+def scale_data(data_dir, name):
+    path = os.path.join(data_dir, name)
+    params_path = os.path.join(path, 'params.json')
+    try:
+        with open(params_path) as f:
+            if json.load(f) == scales[name]:
+                return path
+    except (IOError, OSError, ValueError):
+        pass
+    print('Generating {} data in {}'.format(name, path))
+    synthetic_data.generate(path, **scales[name])
+    with open(params_path, 'w') as f:
+        json.dump(scales[name], f)
+    return path
+
+
+def _git_commit():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', 'HEAD'],
+                                       cwd=os.path.dirname(os.path.abspath(__file__))).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmark the dashboard callbacks on synthetic data.')
+    parser.add_argument('--scales', nargs='+', default=['small', 'medium'], choices=list(scales),
+                        help='data scales to run (default: small medium)')
+    parser.add_argument('--repeat', type=int, default=10, help='timed calls per benchmark (default 10)')
+    parser.add_argument('--data-dir', default=os.path.join(tempfile.gettempdir(), 'mf_dash_benchmark'),
+                        help='directory of the synthetic data')
+    parser.add_argument('--output', help='file to write the results to (default: standard output)')
+    parser.add_argument('--run', metavar='RESULTS_FILE', help=argparse.SUPPRESS)  # Used for the per-scale processes
+    args = parser.parse_args(argv)
+
+    if args.run:
+        data, results = run_benchmarks(args.repeat)
+        with open(args.run, 'w') as f:
+            json.dump({'data': data, 'results': results}, f)
+        return 0
+
+    report = OrderedDict([('created', time.strftime('%Y-%m-%dT%H:%M:%S')),
+                          ('git_commit', _git_commit()),
+                          ('python', platform.python_version()),
+                          ('platform', platform.platform()),
+                          ('repeat', args.repeat),
+                          ('scales', OrderedDict())])
+    for name in args.scales:
+        path = scale_data(args.data_dir, name)
+        env = dict(os.environ, MF_DASH_DATA_DIR=path, MF_DASH_CACHE_DIR=os.path.join(path, 'cache'), **benchmark_env)
+        results_file = os.path.join(path, 'results.json')
+        shutil.rmtree(env['MF_DASH_CACHE_DIR'], ignore_errors=True)  # So that the data is loaded from the CSV files
+        print('Running {} benchmarks'.format(name))
+        sys.stdout.flush()
+        status = subprocess.call([sys.executable, os.path.abspath(__file__), '--run', results_file,
+                                  '--repeat', str(args.repeat)], env=env)
+        if status != 0:
+            print('The {} benchmarks failed with exit status {}'.format(name, status))
+            return status
+        with open(results_file) as f:
+            scale = json.load(f, object_pairs_hook=OrderedDict)
+        report['scales'][name] = OrderedDict([('params', scales[name])] + list(scale.items()))
+
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(output + '\n')
+        print('Results written to {}'.format(args.output))
+    else:
+        print(output)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,151 @@
+# Generic caches used to keep expensive results (e.g. forecasts) around: a bounded in-memory LRU cache, a directory
+# of pickle files that survives restarts and can be shared by several server processes, and the combination of both.
+import hashlib
+import json
+import os
+import pickle
+import threading
+from collections import OrderedDict
+
+
+# Bounded in-memory cache, evicting the least recently used entry once maxsize entries are stored
+class LRUCache(object):
+
+    def __init__(self, maxsize=128):
+        self.maxsize = maxsize
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            if key not in self._entries:
+                return default
+            value = self._entries.pop(key)
+            self._entries[key] = value  # Move to the most recently used end
+            return value
+
+    def set(self, key, value):
+        with self._lock:
+            self._entries.pop(key, None)
+            self._entries[key] = value
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def __contains__(self, key):
+        return key in self._entries
+
+    def __len__(self):
+        return len(self._entries)
+
+
+# Digest of a key of strings/numbers (nested in tuples or lists) that does not depend on the string type: on Python 2,
+# repr('a') != repr(u'a'), but both are encoded the same in JSON. Numpy scalars are encoded as the numbers they hold.
+def key_digest(key):
+    encoded = json.dumps(key, sort_keys=True, default=_json_scalar)
+    return hashlib.sha1(encoded.encode('utf-8')).hexdigest()
+
+
+def _json_scalar(value):
+    if hasattr(value, 'item'):
+        return value.item()
+    raise TypeError('{!r} cannot be part of a cache key'.format(value))
+
+
+# Cache storing every entry as a pickle file in directory. Keys are tuples of strings/numbers, which are named by
+# their JSON encoding (see key_digest), so that e.g. a key built from str names finds an entry stored under unicode ones.
+# If maxsize is given, the least recently used files are removed once there are more than maxsize entries (checked
+# every prune_every writes, since it has to list the whole directory). Reads touch the modification time of a file, so
+# that it orders the files by their last use, in all processes sharing the directory.
+class DiskCache(object):
+
+    prune_every = 100
+
+    def __init__(self, directory, maxsize=None):
+        self.directory = directory
+        self.maxsize = maxsize
+        self._writes = 0
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+
+    def _path(self, key):
+        return os.path.join(self.directory, key_digest(key) + '.pkl')
+
+    def get(self, key, default=None):
+        path = self._path(key)
+        try:
+            with open(path, 'rb') as f:
+                value = pickle.load(f)
+        except (IOError, OSError, EOFError, ValueError, pickle.UnpicklingError):
+            return default
+        try:
+            os.utime(path, None)
+        except OSError:
+            pass  # Removed by another process in the meantime
+        return value
+
+    def set(self, key, value):
+        path = self._path(key)
+        tmp = '{}.{}.tmp'.format(path, os.getpid())
+        with open(tmp, 'wb') as f:
+            pickle.dump(value, f, 2)
+        os.rename(tmp, path)  # Atomic, so that other processes never read a partially written file
+        self._writes += 1
+        if self.maxsize is not None and self._writes % self.prune_every == 0:
+            self._prune()
+
+    def __contains__(self, key):
+        return os.path.exists(self._path(key))
+
+    def __len__(self):
+        return len([name for name in os.listdir(self.directory) if name.endswith('.pkl')])
+
+    def _prune(self):
+        entries = []
+        for name in os.listdir(self.directory):
+            if name.endswith('.pkl'):
+                path = os.path.join(self.directory, name)
+                try:
+                    entries.append((os.path.getmtime(path), path))
+                except OSError:
+                    pass  # Removed by another process in the meantime
+        entries.sort()
+        for _, path in entries[:max(len(entries) - self.maxsize, 0)]:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+
+# In-memory LRU cache in front of an optional DiskCache: entries are written to both, and disk hits are kept in memory.
+# Counts hits (in memory or on disk) and misses.
+class TieredCache(object):
+
+    _missing = object()
+
+    def __init__(self, memory, disk=None):
+        self.memory = memory
+        self.disk = disk
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        value = self.memory.get(key, self._missing)
+        if value is self._missing and self.disk is not None:
+            value = self.disk.get(key, self._missing)
+            if value is not self._missing:
+                self.memory.set(key, value)
+        with self._lock:
+            if value is self._missing:
+                self.misses += 1
+            else:
+                self.hits += 1
+        return default if value is self._missing else value
+
+    def set(self, key, value):
+        self.memory.set(key, value)
+        if self.disk is not None:
+            try:
+                self.disk.set(key, value)
+            except (IOError, OSError):
+                pass  # The in-memory copy is still there
@@ -8,6 +8,11 @@ from timeseries_plot import *  # Import time-series plot callbacks
 from scatter_plot import *  # Import scatter plot callbacks
 from at_a_glance import * # Import at-a-glance callbacks
 from variable_selection import *  # Import callbacks for variable selection options
+import health  # GET /health
+import ingest
+
+server = app.server  # WSGI application, e.g. for gunicorn (see serve.py)
 
 if __name__ == '__main__':
+    ingest.start()  # Check for new monthly data every MF_DASH_INGEST_INTERVAL seconds
     app.run_server()
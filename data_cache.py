@@ -0,0 +1,166 @@
+# Binary cache of the data files, so that start-up does not have to parse dabi_global.csv.
+# The cache directory holds:
+# - values.npy: float32 array of shape (variables x branches x months), branches in DrabTree row order. It is
+#   memory-mapped on load, so only the pages that are actually used are read from disk.
+# - branch_codes.npy: the branch code of every row of values.npy.
+# - meta.json: variable and month names, the branchlist, and a fingerprint (mtime, size, sha1) of each source file.
+#   The fingerprint of dabi_global.csv also has its number of columns and a hash of its rows (see csv_fingerprint).
+# The cache is rebuilt whenever a source file changes. If only the mtime changed but the contents hash is the same,
+# the stored fingerprint is refreshed and the cache is reused.
+import csv
+import hashlib
+import json
+import os
+
+import numpy as np
+import pandas as pd
+
+cache_format = 1
+source_files = ['dabi_global.csv', 'branchlist.csv']
+
+
+def _file_hash(path):
+    sha1 = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            sha1.update(chunk)
+    return sha1.hexdigest()
+
+
+def _fingerprint(path, with_hash=True):
+    st = os.stat(path)
+    fingerprint = {'mtime': st.st_mtime, 'size': st.st_size}
+    if with_hash:
+        fingerprint['sha1'] = _file_hash(path)
+    return fingerprint
+
+
+# Fields of a line of a CSV file, as bytes
+def _csv_fields(line):
+    line = line.rstrip(b'\r\n')
+    if b'"' not in line:
+        return line.split(b',')
+    if str is bytes:  # Python 2
+        return next(csv.reader([line]))
+    return [field.encode('utf-8') for field in next(csv.reader([line.decode('utf-8')]))]
+
+
+# Fingerprint of the CSV file at path with, besides its mtime, size and sha1, its number of columns and a hash of its
+# rows (rows_sha1), all from a single pass over the file. If prefix_columns is given, 'prefix_sha1' is the hash of the
+# rows cut to their first prefix_columns fields: it equals the rows_sha1 of an earlier version of the file with that
+# many columns if columns were only appended to the file since.
+def csv_fingerprint(path, prefix_columns=None):
+    fingerprint = _fingerprint(path, with_hash=False)
+    sha1, rows, prefix = hashlib.sha1(), hashlib.sha1(), hashlib.sha1()
+    columns = None
+    with open(path, 'rb') as f:
+        for line in f:
+            sha1.update(line)
+            fields = _csv_fields(line)
+            if columns is None:
+                columns = len(fields)
+            rows.update(b'\x1f'.join(fields) + b'\n')
+            if prefix_columns:
+                prefix.update(b'\x1f'.join(fields[:prefix_columns]) + b'\n')
+    fingerprint.update(sha1=sha1.hexdigest(), columns=columns, rows_sha1=rows.hexdigest())
+    if prefix_columns:
+        fingerprint['prefix_sha1'] = prefix.hexdigest()
+    return fingerprint
+
+
+# Fingerprints of all source files in data_dir. With rows=True, the fingerprint of dabi_global.csv has the number of
+# columns and hash of rows of csv_fingerprint.
+def source_fingerprints(data_dir, rows=False):
+    fingerprints = dict((name, _fingerprint(os.path.join(data_dir, name))) for name in source_files
+                        if not (rows and name == 'dabi_global.csv'))
+    if rows:
+        fingerprints['dabi_global.csv'] = csv_fingerprint(os.path.join(data_dir, 'dabi_global.csv'))
+    return fingerprints
+
+
+# Names of the source files in data_dir whose size or modification time differ from the given fingerprints
+def changed_sources(data_dir, sources):
+    changed = []
+    for name in source_files:
+        current = _fingerprint(os.path.join(data_dir, name), with_hash=False)
+        if (current['mtime'], current['size']) != (sources[name]['mtime'], sources[name]['size']):
+            changed.append(name)
+    return changed
+
+
+# Version stamp of the data, derived from the contents hash of the source files
+def data_version(sources):
+    return hashlib.sha1(''.join(sources[name]['sha1'] for name in source_files).encode()).hexdigest()[:12]
+
+
+# Return (meta, branchlist, branch_codes, values) from the cache in cache_dir, or None if it is missing or stale
+def read(data_dir, cache_dir):
+    try:
+        with open(os.path.join(cache_dir, 'meta.json')) as f:
+            meta = json.load(f)
+    except (IOError, OSError, ValueError):
+        return None
+    if meta.get('format') != cache_format:
+        return None
+
+    changed = changed_sources(data_dir, meta['sources'])
+    for name in changed:
+        path = os.path.join(data_dir, name)
+        if _file_hash(path) != meta['sources'][name]['sha1']:
+            return None
+        meta['sources'][name].update(_fingerprint(path, with_hash=False))
+    if changed:
+        try:
+            _write_json(os.path.join(cache_dir, 'meta.json'), meta)
+        except (IOError, OSError):
+            pass  # The cache is still valid, we just have to hash the source files again next time
+
+    branchlist = pd.DataFrame(meta['branchlist']['data'], columns=meta['branchlist']['columns'])
+    branch_codes = np.load(os.path.join(cache_dir, 'branch_codes.npy'))
+    return meta, branchlist, branch_codes, mapped_values(cache_dir)
+
+
+# The values array of the cache in cache_dir, memory-mapped read-only. The pages are shared by every process that maps
+# the same file, e.g. all server workers.
+def mapped_values(cache_dir):
+    return np.load(os.path.join(cache_dir, 'values.npy'), mmap_mode='r')
+
+
+# Write the contents of store (and the branchlist it was built from) to the cache in cache_dir, and return its meta.
+# sources are the fingerprints of the source files the store was read from (default: the current ones).
+# Files are written under temporary names and renamed into place, so that concurrent readers never see a partial cache.
+def write(data_dir, cache_dir, branchlist, store, sources=None):
+    meta = {'format': cache_format,
+            'sources': sources or source_fingerprints(data_dir, rows=True),
+            'variables': store.variables,
+            'months': store.months,
+            'branchlist': {'columns': list(branchlist.columns),
+                           'data': branchlist.astype(object).where(branchlist.notnull(), None).values.tolist()}}
+
+    if not os.path.isdir(cache_dir):
+        os.makedirs(cache_dir)
+    suffix = '.{}.tmp'.format(os.getpid())
+
+    path = os.path.join(cache_dir, 'values.npy')
+    values = np.lib.format.open_memmap(path + suffix, mode='w+', dtype=np.float32,
+                                       shape=(len(store.variables), len(store.tree.branch_codes), len(store.months)))
+    for i, variable in enumerate(store.variables):
+        values[i] = store.blocks[variable]
+    values.flush()
+    del values
+    os.rename(path + suffix, path)
+
+    path = os.path.join(cache_dir, 'branch_codes.npy')
+    with open(path + suffix, 'wb') as f:
+        np.save(f, np.asarray(store.tree.branch_codes))
+    os.rename(path + suffix, path)
+
+    _write_json(os.path.join(cache_dir, 'meta.json'), meta)
+    return meta
+
+
+def _write_json(path, obj):
+    tmp = '{}.{}.tmp'.format(path, os.getpid())
+    with open(tmp, 'w') as f:
+        json.dump(obj, f)
+    os.rename(tmp, path)
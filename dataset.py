@@ -0,0 +1,108 @@
+# Central data loading. The branch data and branchlist are read once, here, and every other module gets the
+# hierarchy index and array store from this module instead of reading the CSV files itself. The raw DataFrame is not
+# kept once the store is built, so each process holds a single copy of the data. The store's arrays are read-only.
+# After the first start-up the data is loaded from a binary cache (see data_cache.py) rather than from the CSV files.
+#
+# Everything derived from one version of the data (hierarchy index, array store, ranking and trend indexes, date axis
+# and version stamp) is held by a DataState, and the current one is dataset.state. When new data is ingested (see
+# ingest.py) a new state is built next to the current one and swapped in with a single assignment. Callbacks should
+# read dataset.state once and use that object throughout, so that they see a consistent version of the data.
+import numbers
+import os
+import time
+
+import numpy as np
+import pandas as pd
+
+import data_cache
+from drab_store import DrabStore
+from drab_tree import DrabTree
+from ranking import RankingIndex
+from trend_index import TrendIndex
+
+# Directory holding dabi_global.csv and branchlist.csv. Can be overridden with the MF_DASH_DATA_DIR environment variable.
+data_dir = os.environ.get('MF_DASH_DATA_DIR', '../../Documents/BRAC/MF/MF Branch Data/Data')
+# Directory of the binary data cache. Can be overridden with the MF_DASH_CACHE_DIR environment variable.
+cache_dir = os.environ.get('MF_DASH_CACHE_DIR', os.path.join(data_dir, '.mf_dash_cache'))
+# First month of the data, used for the date axis if the month columns of the data are not dates. Can be set with the
+# MF_DASH_FIRST_MONTH environment variable.
+first_month = os.environ.get('MF_DASH_FIRST_MONTH', '2012-01-01')
+
+
+# Date axis (month ends) of the given month columns: the column names parsed as dates if possible, otherwise
+# consecutive months from first_month
+def month_dates(months):
+    try:
+        dates = pd.to_datetime(months) + pd.offsets.MonthEnd(0)
+        if dates.is_monotonic_increasing and dates.is_unique:
+            return dates
+    except (ValueError, TypeError, OverflowError):
+        pass
+    return pd.date_range(first_month, freq=pd.offsets.MonthEnd(), periods=len(months))
+
+
+# One version of the data and everything derived from it. sources are the fingerprints of the source files it was read
+# from (see data_cache.py).
+class DataState(object):
+
+    def __init__(self, branchlist, tree, store, sources):
+        self.branchlist = branchlist
+        self.tree = tree
+        self.store = store
+        self.sources = sources
+        self.version = data_cache.data_version(sources)
+        self.dates = month_dates(store.months)
+        self.loaded = time.time()
+        self.ranking = RankingIndex(store)  # Ranks are computed (a whole level at a time) on first use
+        self.trends = TrendIndex(store)  # Trends are computed (a whole level at a time) on first use
+
+    # Node of a DRAB list (a node id is returned as is)
+    def resolve(self, drab):
+        return drab if isinstance(drab, numbers.Integral) else self.tree.resolve(drab)
+
+    # Compute the level aggregates of every variable and the KPI ranks up front rather than on first use, e.g. in a
+    # server process before it forks its workers (see serve.py), so that they share them
+    def warm(self):
+        self.store.warm()
+        self.ranking.build(variables=False)
+
+    # Memory held by the data, in bytes
+    @property
+    def nbytes(self):
+        return self.store.nbytes + self.branchlist.memory_usage(deep=True).sum()
+
+
+# Load the data (from the binary cache if it is up to date, from the data files in data_dir otherwise) and build the
+# DRAB hierarchy index and array store. Level aggregates are computed on first use (see DataState.warm). Returns a
+# DataState.
+def load(data_dir, cache_dir):
+    cached = data_cache.read(data_dir, cache_dir)
+    if cached:
+        meta, branchlist, branch_codes, values = cached
+        tree = DrabTree(branchlist)
+        if not np.array_equal(branch_codes, tree.branch_codes):
+            cached = None
+    if cached:
+        store = DrabStore(tree, meta['months'], zip(meta['variables'], values))
+    else:
+        df = pd.read_csv(os.path.join(data_dir, 'dabi_global.csv'))
+        df = df[df.columns[1:]]
+        branchlist = pd.read_csv(os.path.join(data_dir, 'branchlist.csv'))
+        tree = DrabTree(branchlist)
+        store = DrabStore.from_frame(df, tree)
+        try:
+            meta = data_cache.write(data_dir, cache_dir, branchlist, store)
+            # Use the memory-mapped cache rather than the arrays just built, so that processes share one copy
+            store = DrabStore(tree, meta['months'], zip(meta['variables'], data_cache.mapped_values(cache_dir)))
+        except (IOError, OSError) as e:
+            print('Could not write data cache to {}: {}'.format(cache_dir, e))
+            meta = {'sources': data_cache.source_fingerprints(data_dir)}
+
+    return DataState(branchlist, tree, store, meta['sources'])
+
+
+_start = time.time()
+state = load(data_dir, cache_dir)
+print('Loaded {} variables for {} branches x {} months in {:.2f}s ({:.1f} MB in memory, data version {})'.format(
+    len(state.store.variables), len(state.tree.branch_codes), len(state.store.months), time.time() - _start,
+    state.nbytes / 1e6, state.version))
@@ -1,7 +1,9 @@
-from dash.dependencies import Input, Output
+from dash.dependencies import Input, Output, State
+from dash.exceptions import PreventUpdate
 from layout import *  # We import layout (and initialize app) from layout.py
+import dataset  # The DRAB hierarchy index of the current data is dataset.state.tree
 
-# Callbacks to show/hide secondary DRAB selector
+# Callbacks to show/hide secondary DRAB selector and N-way comparison selector
 
 
 @app.callback(
@@ -18,21 +20,73 @@ def adjust_primary_drab(value):
     Output('secondary_drab', 'style'),
     [Input('drab_tabs', 'value')])
 def show_secondary_drab(value):
-    if value == 1: # Hide secondary drab selector
+    if value != 2: # Hide secondary drab selector
         return {'display': 'none'}
     else: # Show secondary drab selector
         return {'display': 'inline-block', 'width': '42.5%', 'vertical-align': 'middle'}
 
 
-# Callbacks to update location specifier dropdowns:
+@app.callback(
+    Output('compare_drabs', 'style'),
+    [Input('drab_tabs', 'value')])
+def show_compare_drabs(value):
+    if value != 3:
+        return {'display': 'none'}
+    else:
+        return {'display': 'inline-block', 'width': '42.5%', 'vertical-align': 'middle'}
+
+
+# Adds the sub-DRABs of the primary selection (e.g. all areas of a region) to the DRABs to compare
+@app.callback(
+    Output('compare_nodes', 'value'),
+    [Input('compare_children', 'n_clicks')],
+    [State('compare_nodes', 'value'),
+     State('division', 'value'),
+     State('region', 'value'),
+     State('area', 'value'),
+     State('branch', 'value')])
+def add_compare_children(n_clicks, compare_nodes, division, region, area, branch):
+    if not n_clicks:
+        raise PreventUpdate()
+    tree = dataset.state.tree
+    node = tree.resolve([division, region, area, branch])
+    compare_nodes = list(compare_nodes or [])
+    for child in tree.children[node] or [node]:
+        value = compare_value(tree.path[child])
+        if value not in compare_nodes:
+            compare_nodes.append(value)
+    return compare_nodes[:max_compare]
+
+
+# The options of the DRABs to compare follow the primary selection, see compare_options
+@app.callback(
+    Output('compare_nodes', 'options'),
+    [Input('division', 'value'),
+     Input('region', 'value'),
+     Input('area', 'value'),
+     Input('branch', 'value')],
+    [State('compare_nodes', 'value')])
+def update_compare_options(division, region, area, branch, compare_nodes):
+    return compare_options(dataset.state, [division, region, area, branch], compare_nodes)
+
+
+# The DRABs selected in the given tab: the primary DRAB, the primary and secondary DRABs, or the DRABs to compare
+def selected_drabs(drab_tabs, drab, drab2, compare_nodes):
+    if drab_tabs == 2:
+        return [drab, drab2]
+    if drab_tabs == 3 and compare_nodes:
+        return [compare_drab(value) for value in compare_nodes[:max_compare]]
+    return [drab]
+
+
+# Callbacks to update location specifier dropdowns. Options are precomputed in the DRAB hierarchy index.
 
 
 @app.callback(
     Output('region', 'options'),
     [Input('division', 'value')])
 def update_region(input_value):
-    foo = branchlist[branchlist['Division'].isin([input_value])]
-    return [{'label': x, 'value': x} for x in foo['Region'].unique()]
+    return dataset.state.tree.child_options([input_value])
 
 
 @app.callback(
@@ -40,9 +94,7 @@ def update_region(input_value):
     [Input('region', 'value'),
      Input('division', 'value')])
 def update_area(region, division):
-    foo = branchlist[branchlist['Division'].isin([division])]
-    foo = foo[foo['Region'].isin([region])]
-    return [{'label': x, 'value': x} for x in foo['Area'].unique()]
+    return dataset.state.tree.child_options([division, region])
 
 
 @app.callback(
@@ -51,10 +103,7 @@ def update_area(region, division):
      Input('region', 'value'),
      Input('division', 'value')])
 def update_branch(area, region, division):
-    foo = branchlist[branchlist['Division'].isin([division])]
-    foo = foo[foo['Region'].isin([region])]
-    foo = foo[foo['Area'].isin([area])]
-    return [{'label': x, 'value': x} for x in foo['Branch'].unique()]
+    return dataset.state.tree.child_options([division, region, area])
 
 
 # Callbacks to update location specifier dropdowns for the optional second DRAB selector:
@@ -64,8 +113,7 @@ def update_branch(area, region, division):
     Output('region2', 'options'),
     [Input('division2', 'value')])
 def update_region2(input_value):
-    foo = branchlist[branchlist['Division'].isin([input_value])]
-    return [{'label': x, 'value': x} for x in foo['Region'].unique()]
+    return dataset.state.tree.child_options([input_value])
 
 
 @app.callback(
@@ -73,9 +121,7 @@ def update_region2(input_value):
     [Input('region2', 'value'),
      Input('division2', 'value')])
 def update_area2(region, division):
-    foo = branchlist[branchlist['Division'].isin([division])]
-    foo = foo[foo['Region'].isin([region])]
-    return [{'label': x, 'value': x} for x in foo['Area'].unique()]
+    return dataset.state.tree.child_options([division, region])
 
 
 @app.callback(
@@ -84,7 +130,4 @@ def update_area2(region, division):
      Input('region2', 'value'),
      Input('division2', 'value')])
 def update_branch2(area, region, division):
-    foo = branchlist[branchlist['Division'].isin([division])]
-    foo = foo[foo['Region'].isin([region])]
-    foo = foo[foo['Area'].isin([area])]
-    return [{'label': x, 'value': x} for x in foo['Branch'].unique()]
\ No newline at end of file
+    return dataset.state.tree.child_options([division, region, area])
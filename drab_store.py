@@ -0,0 +1,151 @@
+import numpy as np
+
+from drab_tree import drab_levels
+
+agg_types = ['sum', 'mean', 'count']
+
+
+# Storage layer for the branch data. Every variable is held as one dense float32 (branches x months) array, with rows
+# grouped by Division -> Region -> Area -> Branch in the order laid out by the DrabTree. Every DRAB node therefore
+# covers a contiguous range of rows, and its sum/mean/non-missing count can be computed with a single np.add.reduceat
+# (whole level) or slice reduction (one node), without any pandas merge or groupby.
+class DrabStore(object):
+
+    # blocks is an optional list of (variable, block) pairs, e.g. memory-mapped arrays from the binary data cache
+    def __init__(self, tree, months, blocks=()):
+        self.tree = tree
+        self.months = list(months)
+        self.row_of = dict((code, i) for i, code in enumerate(tree.branch_codes))
+
+        self.blocks = {}
+        self.variables = []  # in order of first appearance in the data
+        self._level_cache = {}
+        for variable, block in blocks:
+            self.set_block(variable, block)
+
+    # Build a store from a DataFrame with one row per (branch_code, variable) and one column per month
+    @classmethod
+    def from_frame(cls, df, tree):
+        store = cls(tree, [c for c in df.columns if c not in ('branch_code', 'variable')])
+        for variable, frame in df.groupby('variable', sort=False):
+            store.add_variable(variable, frame)
+        return store
+
+    # Memory held by the value blocks and the cached aggregates, in bytes
+    @property
+    def nbytes(self):
+        return (sum(block.nbytes for block in self.blocks.values()) +
+                sum(a.nbytes for aggregates in self._level_cache.values() for a in aggregates.values()))
+
+    # Pivot the rows of frame (branch_code + month columns) into a (branches x months) block for variable.
+    # Branches without data are left as NaN; branches missing from the branchlist are dropped.
+    # Can be called after start-up to add (or replace) a variable.
+    def add_variable(self, variable, frame):
+        block = np.full((len(self.row_of), len(self.months)), np.nan, dtype=np.float32)
+        rows = np.array([self.row_of.get(code, -1) for code in frame['branch_code'].values], dtype=int)
+        known = rows >= 0
+        block[rows[known]] = frame[self.months].values[known]
+        self.set_block(variable, block)
+
+    # Add (or replace) the (branches x months) block of variable. The block is made read-only.
+    def set_block(self, variable, block):
+        block.flags.writeable = False
+        if variable not in self.blocks:
+            self.variables.append(variable)
+        self.blocks[variable] = block
+        for level in ['Global'] + drab_levels:
+            self._level_cache.pop((variable, level), None)
+
+    # Raw (branches x months) values of variable for all branches under the given node
+    def rows(self, variable, node):
+        return self.blocks[variable][self.tree.start[node]:self.tree.stop[node]]
+
+    # Sum, mean and non-missing count of variable for every node at level (in tree.level_nodes order), as
+    # (nodes x months) arrays. Computed with np.add.reduceat; levels above Branch are kept until the variable is
+    # replaced, the Branch level (which would be as large as the data itself) is recomputed on every call.
+    def level_aggregate(self, variable, level):
+        key = (variable, level)
+        if key in self._level_cache:
+            return self._level_cache[key]
+
+        block = self.blocks[variable]
+        valid = ~np.isnan(block)
+        starts = [self.tree.start[node] for node in self.tree.level_nodes[level]]
+        total = np.add.reduceat(np.where(valid, block, 0), starts, axis=0, dtype=np.float64)
+        count = np.add.reduceat(valid, starts, axis=0, dtype=np.int64)
+        aggregates = {'sum': total, 'mean': _mean(total, count), 'count': count}
+        if level != 'Branch':
+            for a in aggregates.values():
+                a.flags.writeable = False
+            self._level_cache[key] = aggregates
+        return aggregates
+
+    # Aggregate values (sum, mean or count) of variable for a single node, as a 1-d array over months
+    def node_aggregate(self, variable, node, agg_type):
+        level = self.tree.level[node]
+        if level == 'Branch':
+            # Branches are rarely more than one row, so a slice reduction is cheaper than a full-level reduceat
+            rows = self.rows(variable, node)
+            valid = ~np.isnan(rows)
+            total = np.where(valid, rows, 0).sum(axis=0, dtype=np.float64)
+            count = valid.sum(axis=0)
+            return {'sum': total, 'mean': _mean(total, count), 'count': count}[agg_type]
+        return self.level_aggregate(variable, level)[agg_type][self.tree.level_index[node]]
+
+    # Aggregate values of variable for several nodes at once, as a (nodes x months) array. Nodes are read from the level
+    # aggregates with one fancy-indexing operation per level (except for a handful of branches, which are cheaper to
+    # reduce one by one).
+    def node_aggregates(self, variable, nodes, agg_type):
+        out = np.empty((len(nodes), len(self.months)))
+        levels = [self.tree.level[node] for node in nodes]
+        for level in set(levels):
+            positions = [j for j in range(len(nodes)) if levels[j] == level]
+            if level == 'Branch' and len(positions) < 10:
+                for j in positions:
+                    out[j] = self.node_aggregate(variable, nodes[j], agg_type)
+            else:
+                index = [self.tree.level_index[nodes[j]] for j in positions]
+                out[positions] = self.level_aggregate(variable, level)[agg_type][index]
+        return out
+
+    # Return a new store with the months of frame (branch_code + variable + one column per new month) appended to the
+    # months of this one. This store is left untouched, so it can keep serving requests until the new one replaces it.
+    # Only the new months are aggregated: cached level aggregates of the existing months are carried over.
+    def append_months(self, frame):
+        added = DrabStore.from_frame(frame, self.tree)
+        store = DrabStore(self.tree, self.months + added.months)
+        for variable in self.variables + [v for v in added.variables if v not in self.blocks]:
+            store.set_block(variable, np.hstack([self._months_block(variable, len(self.months)),
+                                                 added._months_block(variable, len(added.months))]))
+        for (variable, level), aggregates in self._level_cache.items():
+            if variable in added.blocks:
+                new = added.level_aggregate(variable, level)
+                combined = dict((a, np.concatenate([aggregates[a], new[a]], axis=1)) for a in agg_types)
+                for a in combined.values():
+                    a.flags.writeable = False
+                store._level_cache[(variable, level)] = combined
+        return store
+
+    # A store with the same months and level aggregates as this one, with the value blocks replaced by the given
+    # (variable, block) pairs holding the same values, e.g. the memory-mapped data cache written from this store
+    def remapped(self, blocks):
+        store = DrabStore(self.tree, self.months, blocks)
+        store._level_cache = dict(self._level_cache)
+        return store
+
+    # The (branches x months) block of variable, or an all-NaN block if there is no data for it
+    def _months_block(self, variable, months):
+        if variable in self.blocks:
+            return self.blocks[variable]
+        return np.full((len(self.row_of), months), np.nan, dtype=np.float32)
+
+    # Precompute the aggregates of every variable at every level above Branch
+    def warm(self):
+        for variable in self.blocks:
+            for level in ['Global'] + drab_levels[:-1]:
+                self.level_aggregate(variable, level)
+
+
+def _mean(total, count):
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return np.where(count > 0, total / count, np.nan)
@@ -0,0 +1,86 @@
+# DRAB levels, from coarsest to finest.
+drab_levels = ['Division', 'Region', 'Area', 'Branch']
+
+
+# Index of the division -> region -> area -> branch hierarchy, built once from the branchlist.
+# Every node gets an integer id (0 is the Global root) and is identified by its full path of names, e.g.
+# (division, region) for a region, so that equally named areas/branches in different parts of the tree never mix.
+# Branches are laid out in depth-first order, so every node covers a contiguous range [start, stop) of rows; this is
+# the row order used by the array store.
+class DrabTree(object):
+
+    def __init__(self, branchlist):
+        self.level = ['Global']
+        self.name = ['Global']
+        self.path = [()]
+        self.parent = [None]
+        self.children = [[]]
+        self.ids = {(): 0}  # path -> node id
+        self.child_ids = [{}]  # per node: child name -> child node id
+        leaf_codes = {}  # branch node id -> branch codes
+
+        # Children are kept in order of first appearance in the branchlist, which is also the dropdown order
+        names = [branchlist[level].values for level in drab_levels]
+        for code, row in zip(branchlist['branch_code'].values, zip(*names)):
+            node = 0
+            for depth, name in enumerate(row):
+                child = self.child_ids[node].get(name)
+                if child is None:
+                    child = len(self.level)
+                    self.level.append(drab_levels[depth])
+                    self.name.append(name)
+                    self.path.append(row[:depth + 1])
+                    self.parent.append(node)
+                    self.children.append([])
+                    self.child_ids.append({})
+                    self.ids[row[:depth + 1]] = child
+                    self.child_ids[node][name] = child
+                    self.children[node].append(child)
+                node = child
+            leaf_codes.setdefault(node, []).append(code)
+
+        # Depth-first layout of the branch rows, and the row range covered by each node
+        self.start = [0] * len(self.level)
+        self.stop = [0] * len(self.level)
+        codes = []
+
+        def layout(node):
+            self.start[node] = len(codes)
+            codes.extend(leaf_codes.get(node, []))
+            for child in self.children[node]:
+                layout(child)
+            self.stop[node] = len(codes)
+
+        layout(0)
+        self.branch_codes = codes  # branch codes in row order
+
+        # Node ids of each level in row order, and the position of each node within its level
+        self.level_nodes = {'Global': [0]}
+        for level in drab_levels:
+            self.level_nodes[level] = sorted((i for i in range(len(self.level)) if self.level[i] == level),
+                                             key=lambda i: self.start[i])
+        self.level_index = [0] * len(self.level)
+        for nodes in self.level_nodes.values():
+            for j, node in enumerate(nodes):
+                self.level_index[node] = j
+
+        self.branch_code_sets = [frozenset(codes[self.start[i]:self.stop[i]]) for i in range(len(self.level))]
+        self.options = [[{'label': self.name[c], 'value': self.name[c]} for c in self.children[i]]
+                        for i in range(len(self.level))]
+
+    # Dropdown options for the children of the node with the given path of names (empty if the path is invalid)
+    def child_options(self, path):
+        node = self.ids.get(tuple(path))
+        return self.options[node] if node is not None else []
+
+    # Resolve a DRAB list [division, region, area, branch] to a node id.
+    # We want the last value of division->region->area->branch that is non-empty AND is compatible with
+    # previous entries!!! -> If we do not check the second condition then updating the graph may fail.
+    def resolve(self, drab):
+        node = 0
+        for name in drab:
+            child = self.child_ids[node].get(name)
+            if child is None:
+                break
+            node = child
+        return node
@@ -1,93 +1,59 @@
 import pandas as pd
 
-# Load data and branchlist for reference of function
-df_main = pd.read_csv('../../Documents/BRAC/MF/MF Branch Data/Data/dabi_global.csv')
-df_main = df_main[df_main.columns[1:]]
-branchlist = pd.read_csv('../../Documents/BRAC/MF/MF Branch Data/Data/branchlist.csv')
+import dataset  # The current data is dataset.state
 
 
 # Function that filters df based on list of variable names, aggregates df based on a DRAB list (either as sum or mean)
-# We want the last value of division->region->area->branch that is non-empty AND is compatible with
-# previous entries!!! -> If we do not check the second condition then updating the graph may fail.
+# The DRAB is resolved through the hierarchy index and the aggregates are read from the array store, so no merging or
+# grouping happens here. The data is read from state (default: the current dataset.state).
 
-def filter_df(var_names, drab, agg_type, return_all=False): # agg_type = 'sum' or 'mean', var_names and drab are lists
+def filter_df(var_names, drab, agg_type, return_all=False, state=None): # agg_type = 'sum', 'mean' or 'count', var_names and drab are lists
     # drab MUST have length = 4, missing entries are filled by None.
     # return_all is a boolean. If true, filter_df returns the aggregated variable values for ALL locations within the
     # target DRAB hierarchy.
-
-    division, region, area, branch = drab
-
-    # First, filter the dataframe, so that only the relevant variables are being considered
-    y = df_main[df_main['variable'].isin(var_names)]
-    y = pd.merge(branchlist, y, on='branch_code')
-
-    name = 'foo'
-
-    if division == 'Global':
-        if agg_type == 'mean':
-            y = y.groupby('variable').mean()
-        else:
-            y = y.groupby('variable').sum()
-        y = y[y.columns[1:]]
-        name = division
-
+    state = state or dataset.state
+
+    if not return_all:
+        return query_batch([(drab, var_names, agg_type)], state)[0]
+
+    tree, store = state.tree, state.store
+    node = tree.resolve(drab)
+    if node:
+        # Every node sharing the same parent, indexed by (node, variable)
+        nodes = tree.children[tree.parent[node]]
+        index = pd.MultiIndex.from_tuples([(tree.name[n], v) for n in nodes for v in var_names],
+                                          names=[tree.level[node], 'variable'])
     else:
-        # Filter at division level.
-        # The following condition checks whether the value of region is valid, given the value of division.
-        # If it is not, then we aggregate by division.
-        if not region or not pd.Series(region).isin(
-                branchlist[branchlist['Division'].isin([division])]['Region']).bool():
-            if agg_type == 'mean':
-                y = y.groupby(['Division', 'variable']).mean()
-            else:
-                y = y.groupby(['Division', 'variable']).sum()
-            y = y[y.columns[1:]]  # Delete the first column, since this is the mean of branch_code
-            if not return_all:
-                y = y.loc[[(division, i) for i in var_names]]
-                y = y.loc[division] # This deletes the first redundant entry of the multiIndex
-            name = division
-
-        # Filter at region level.
-        # Check whether value of area is valid, given value of region. If not, aggregate by region.
-        elif not area or not pd.Series(area).isin(branchlist[branchlist['Region'].isin([region])]['Area']).bool():
-            y = y.loc[y['Division'].isin([division])]
-            if agg_type == 'mean':
-                y = y.groupby(['Region', 'variable']).mean()
-            else:
-                y = y.groupby(['Region', 'variable']).sum()
-            y = y[y.columns[1:]]
-            if not return_all:
-                y = y.loc[[(region, i) for i in var_names]]
-                y = y.loc[region]
-            name = region
-
-        # Filter at area level.
-        elif not branch or not pd.Series(branch).isin(branchlist[branchlist['Area'].isin([area])]['Branch']).bool():
-            y = y.loc[y['Division'].isin([division])]
-            y = y.loc[y['Region'].isin([region])]
-            if agg_type == 'mean':
-                y = y.groupby(['Area', 'variable']).mean()
-            else:
-                y = y.groupby(['Area', 'variable']).sum()
-            y = y[y.columns[1:]]
-            if not return_all:
-                y = y.loc[[(area, i) for i in var_names]]
-                y = y.loc[area]
-            name = area
-
-        # Filter at branch level.
-        elif branch:
-            y = y.loc[y['Division'].isin([division])]
-            y = y.loc[y['Region'].isin([region])]
-            y = y.loc[y['Area'].isin([area])]
-            if agg_type == 'mean':
-                y = y.groupby(['Branch', 'variable']).mean()
-            else:
-                y = y.groupby(['Branch', 'variable']).sum()
-            y = y[y.columns[1:]]
-            if not return_all:
-                y = y.loc[[(branch, i) for i in var_names]]
-                y = y.loc[branch]
-            name = branch
-
-    return {'name': name, 'data': y}
+        nodes = [node]
+        index = pd.Index(var_names, name='variable')
+
+    values = dict((v, store.node_aggregates(v, nodes, agg_type)) for v in var_names)
+    y = pd.DataFrame([values[v][i] for i in range(len(nodes)) for v in var_names], index=index, columns=store.months)
+
+    return {'name': tree.name[node], 'node': node, 'data': y}
+
+
+# Batched version of filter_df: answers a list of (drab, var_names, agg_type) requests at once, e.g. the selected DRAB
+# and the mean overlays of a graph. Each drab can also be given as a node id. Every (variable, agg_type) pair is read
+# for all requested DRABs with a single DrabStore.node_aggregates call. Returns a list of {'name', 'node', 'data'}
+# dicts, one per request, as filter_df does.
+def query_batch(requests, state=None):
+    state = state or dataset.state
+    tree, store = state.tree, state.store
+    nodes = [state.resolve(drab) for drab, _, _ in requests]
+
+    wanted = {}  # (variable, agg_type) -> nodes
+    for node, (_, var_names, agg_type) in zip(nodes, requests):
+        for v in var_names:
+            wanted.setdefault((v, agg_type), set()).add(node)
+    values = {}  # (variable, agg_type, node) -> aggregate values
+    for (v, agg_type), wanted_nodes in wanted.items():
+        wanted_nodes = sorted(wanted_nodes)
+        for node, row in zip(wanted_nodes, store.node_aggregates(v, wanted_nodes, agg_type)):
+            values[v, agg_type, node] = row
+
+    return [{'name': tree.name[node],
+             'node': node,
+             'data': pd.DataFrame([values[v, agg_type, node] for v in var_names],
+                                  index=pd.Index(var_names, name='variable'), columns=store.months)}
+            for node, (_, var_names, agg_type) in zip(nodes, requests)]
@@ -0,0 +1,47 @@
+# Cache of forecast results (e.g. ARIMA), so that repeated views of the same forecast do not have to fit the model
+# again. Results are kept in a bounded in-memory LRU cache and, optionally, in an on-disk store that survives restarts.
+#
+# Keys should identify everything the forecast depends on: e.g. ('arima', DRAB path, variable, first month, last month,
+# look-ahead, data version). The data version ensures that forecasts are never reused after the data has changed.
+import os
+
+import dataset
+from cache import LRUCache, DiskCache, TieredCache
+
+# Number of forecasts kept in memory. Can be set with the MF_DASH_FORECAST_CACHE_SIZE environment variable.
+memory_cache = LRUCache(maxsize=int(os.environ.get('MF_DASH_FORECAST_CACHE_SIZE', 512)))
+
+# Directory of the on-disk forecast store. Can be set with the MF_DASH_FORECAST_DIR environment variable; set it to an
+# empty string to disable the on-disk store.
+forecast_dir = os.environ.get('MF_DASH_FORECAST_DIR', os.path.join(dataset.cache_dir, 'forecasts'))
+disk_cache = None
+if forecast_dir:
+    try:
+        disk_cache = DiskCache(forecast_dir, maxsize=int(os.environ.get('MF_DASH_FORECAST_DIR_SIZE', 100000)))
+    except (IOError, OSError) as e:
+        print('Forecasts will not be stored on disk, could not create {}: {}'.format(forecast_dir, e))
+
+_cache = TieredCache(memory_cache, disk_cache)
+
+
+# Return the cached result for key, or None if there is none
+def get(key):
+    return _cache.get(key)
+
+
+def put(key, result):
+    _cache.set(key, result)
+
+
+# Return the cached result for key, computing (and caching) it with compute() if there is none
+def cached(key, compute):
+    result = get(key)
+    if result is None:
+        result = compute()
+        put(key, result)
+    return result
+
+
+# Hit and miss counts of the cache, e.g. {'hits': 3, 'misses': 1}
+def stats():
+    return {'hits': _cache.hits, 'misses': _cache.misses}
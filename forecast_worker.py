@@ -0,0 +1,168 @@
+# Non-blocking forecast execution. Forecast models (e.g. the R auto.arima fit, whose embedded interpreter is not
+# thread-safe) are fitted in dedicated worker processes, fed one job at a time by dispatcher threads in the server
+# process. Callbacks never wait for a fit: they ask for a forecast, get it if it is already in the forecast cache, and
+# otherwise queue it and render without it.
+#
+# Every request (and every poll of the forecast status) marks a job as wanted. Queued jobs that nobody has asked for in
+# the last stale_after seconds (i.e. the user has changed the selection) are dropped, and queued again if they are asked
+# for after all (e.g. by a page in a background tab whose polls were throttled), as are jobs whose results have been
+# evicted from the forecast cache before they were shown. Fits running longer than timeout seconds are killed along
+# with their worker process. Fits that failed are tried again once retry_after seconds have passed. Worker processes
+# exit when the server process goes away.
+import multiprocessing
+import os
+import threading
+import time
+from collections import OrderedDict
+
+import forecast_cache
+from cache import LRUCache
+
+
+# Body of a worker process: fit the forecasts sent through conn one at a time, and send back the results. Exits when
+# the server process (parent) is gone, e.g. when a gunicorn worker is killed: the end of the pipe held by the server is
+# closed here, so recv() fails once the server process closes it, and as the worker processes of the other dispatchers
+# may hold copies of it, the parent process id is checked as well.
+def _serve(conn, server_conn, fit, parent):
+    server_conn.close()
+    while True:
+        try:
+            while not conn.poll(1):
+                if os.getppid() != parent:
+                    return
+            args = conn.recv()
+        except (EOFError, IOError, OSError):
+            return
+        try:
+            result = ('ok', fit(*args))
+        except Exception as e:
+            result = ('error', repr(e))
+        try:
+            conn.send(result)
+        except (IOError, OSError):
+            return
+
+
+class ForecastWorker(object):
+
+    # fit(*args) is run in the worker process(es) and its result stored in the forecast cache. job_args(key) returns
+    # the args of the job with the given key (or None if it cannot be fitted any more), to queue it again when it is
+    # polled for but neither queued, running nor cached.
+    def __init__(self, fit, job_args=None, processes=1, timeout=60, stale_after=10, retry_after=600):
+        self.fit = fit
+        self.job_args = job_args
+        self.processes = processes
+        self.timeout = timeout
+        self.stale_after = stale_after
+        self.retry_after = retry_after
+        self.failed = LRUCache(maxsize=1000)  # key -> (time, error message) of the fits that failed
+        self._lock = threading.Condition()
+        self._queued = OrderedDict()  # key -> args
+        self._running = set()
+        self._wanted = {}  # key -> last time the job was asked for
+        self._threads = []
+
+    # Return the forecast with the given key if it is available. Otherwise queue fit(*args) (unless it is already
+    # queued, running or has failed recently) and return None.
+    def request(self, key, args):
+        result = forecast_cache.get(key)
+        if result is not None:
+            return result
+        with self._lock:
+            self._wanted[key] = time.time()
+            self._submit(key, args)
+        return None
+
+    # Whether the forecast with the given key is still to come (i.e. neither cached nor failed recently). Also marks
+    # the job as still wanted, and queues it again if it is neither queued nor running, e.g. because it was dropped as
+    # stale or its result was evicted from the forecast cache.
+    def pending(self, key):
+        if forecast_cache.get(key) is not None or self._failed(key):
+            return False
+        with self._lock:
+            self._wanted[key] = time.time()
+            if key in self._queued or key in self._running:
+                return True
+        args = self.job_args(key) if self.job_args else None
+        if args is None:
+            return False  # E.g. a forecast of a previous version of the data
+        with self._lock:
+            self._submit(key, args)
+        return True
+
+    # Whether the fit of key failed less than retry_after seconds ago
+    def _failed(self, key):
+        failure = self.failed.get(key)
+        return failure is not None and time.time() - failure[0] < self.retry_after
+
+    # Called with the lock held: queue fit(*args) unless it is already queued, running or has failed recently
+    def _submit(self, key, args):
+        if key not in self._queued and key not in self._running and not self._failed(key):
+            self._queued[key] = args
+            self._start()
+            self._lock.notify()
+
+    def _start(self):
+        while len(self._threads) < self.processes:
+            thread = threading.Thread(target=self._dispatch)
+            thread.daemon = True
+            thread.start()
+            self._threads.append(thread)
+
+    # Called with the lock held: drop stale jobs, and return the most recently wanted one (or None if there is none)
+    def _next_job(self):
+        now = time.time()
+        for key in list(self._wanted):
+            if now - self._wanted[key] > self.stale_after and key not in self._running:
+                self._queued.pop(key, None)
+                del self._wanted[key]
+        while self._queued:
+            key = max(self._queued, key=lambda k: self._wanted[k])
+            args = self._queued.pop(key)
+            if forecast_cache.get(key) is None:  # Not already fitted, e.g. by the process of another server
+                return key, args
+        return None
+
+    def _spawn(self):
+        conn, child_conn = multiprocessing.Pipe()
+        process = multiprocessing.Process(target=_serve, args=(child_conn, conn, self.fit, os.getpid()))
+        process.daemon = True
+        process.start()
+        return process, conn
+
+    # Dispatcher thread: feeds jobs to its own worker process, and restarts the process if it dies or times out
+    def _dispatch(self):
+        process, conn = None, None
+        while True:
+            with self._lock:
+                job = self._next_job()
+                while job is None:
+                    self._lock.wait(self.stale_after)
+                    job = self._next_job()
+                key, args = job
+                self._running.add(key)
+
+            if process is None or not process.is_alive():
+                if conn is not None:
+                    conn.close()
+                process, conn = self._spawn()
+            try:
+                conn.send(args)
+                if conn.poll(self.timeout):
+                    status, result = conn.recv()
+                else:
+                    status, result = 'error', 'timed out after {}s'.format(self.timeout)
+                    process.terminate()
+                    process = None
+            except (EOFError, IOError, OSError) as e:
+                status, result = 'error', repr(e)
+                process = None
+
+            if status == 'ok':
+                forecast_cache.put(key, result)
+            else:
+                print('Forecast {} failed: {}'.format(key, result))
+                self.failed.set(key, (time.time(), result))
+            with self._lock:
+                self._running.discard(key)
+                self._wanted.pop(key, None)
@@ -0,0 +1,262 @@
+# Forecasting functions shared by the time-series callbacks and the batch precomputation of forecasts.
+#
+# Forecast models are provided by pluggable backends, selected with the MF_DASH_FORECAST_BACKEND environment variable:
+# - 'arima' (default): automatic ARIMA order selection, fitted with statsmodels.
+# - 'ets': exponential smoothing (with no, linear or damped trend), fitted with statsmodels.
+# - 'hw': additive Holt-Winters with a seasonal period of 12 months (see batch_forecast.py). Can fit a whole matrix of
+#   series at once, which makes it the fastest backend for precomputing forecasts.
+# - 'trend': the least-squares trend line extended into the future, with the prediction interval of the regression (see
+#   batch_forecast.py). Also fits a whole matrix of series at once.
+# - 'r': auto.arima from the R 'forecast' package, through rpy2. R is only started (and missing R packages installed)
+#   when the first forecast is fitted, so the dashboard starts without R.
+# Every backend returns the mean of the forecast and the upper and lower bounds of its 80% confidence interval.
+import itertools
+import os
+import warnings
+
+import numpy as np
+
+import batch_forecast
+import dataset
+from trend_index import trend_window
+
+
+# Restrict y (and the corresponding dates t) to the last forecast_look_back entries (or all of them if 'all')
+def look_back_window(y, t, forecast_look_back):
+    if not forecast_look_back == 'all':
+        if len(y) > forecast_look_back:
+            y = y[-forecast_look_back:]
+            t = t[-forecast_look_back:]
+    return y, t
+
+
+# Cache key of a forecast (e.g. kind = 'arima') of variable for a DRAB node. The key contains the months the
+# forecast is actually based on, i.e. the look-back window at the end of the selected timeframe, and for model
+# forecasts the backend that fitted them. node is a node of state (default: the current dataset.state).
+def forecast_key(kind, node, variable, timeframe, forecast_look_back, forecast_look_ahead, state=None):
+    state = state or dataset.state
+    start, stop = trend_window(forecast_look_back, min(timeframe[1], len(state.store.months)), timeframe[0])
+    if kind == 'arima':
+        kind = 'arima-' + backend.name
+    return kind, state.tree.path[node], variable, start, stop, forecast_look_ahead, state.version
+
+
+# Arguments (y, look-ahead) of arima_forecast for the forecast with the given key (see forecast_key), i.e. the per-branch
+# mean of the variable over the months of the key, or None if the key is not of state (default: dataset.state)
+def forecast_args(key, state=None):
+    state = state or dataset.state
+    kind, path, variable, start, stop, forecast_look_ahead, version = key
+    node = state.tree.ids.get(tuple(path))
+    if version != state.version or node is None or variable not in state.store.blocks:
+        return None
+    return state.store.node_aggregate(variable, node, 'mean')[start:stop], forecast_look_ahead
+
+
+# Interface of the forecasting backends
+class ForecastBackend(object):
+
+    name = None
+
+    # Return the mean and the upper and lower bounds of the 80% confidence interval of the forecast of the next
+    # forecast_look_ahead months, as three arrays, given the monthly values y (which may contain NaNs)
+    def forecast(self, y, forecast_look_ahead):
+        raise NotImplementedError()
+
+    # Forecasts of every row of Y (series x months), as three (series x forecast_look_ahead) arrays. Series that cannot
+    # be fitted get NaN forecasts. Backends that can fit all series at once override this.
+    def forecast_batch(self, Y, forecast_look_ahead):
+        out = np.full((3, len(Y), forecast_look_ahead), np.nan)
+        for i, y in enumerate(Y):
+            try:
+                out[:, i] = self.forecast(y, forecast_look_ahead)
+            except Exception as e:
+                print('Forecast of series {} failed: {!r}'.format(i, e))
+        return out[0], out[1], out[2]
+
+
+# Automatic ARIMA model selection in the spirit of R's auto.arima: the order of differencing is chosen with KPSS tests,
+# then the (p, q) orders with the lowest AICc are picked, with a constant (d = 0) or drift (d = 1) term.
+class ArimaBackend(ForecastBackend):
+
+    name = 'arima'
+    max_p = 2
+    max_q = 2
+    max_d = 2
+
+    def __init__(self):
+        # Imported here so that the other backends can be used without statsmodels
+        from statsmodels.tsa.statespace.sarimax import SARIMAX
+        from statsmodels.tsa.stattools import kpss
+        self._sarimax = SARIMAX
+        self._kpss = kpss
+
+    def differences(self, y):
+        y = y[~np.isnan(y)]
+        d = 0
+        while d < self.max_d and len(y) > 8:
+            with warnings.catch_warnings():
+                warnings.simplefilter('ignore')
+                p_value = self._kpss(y, regression='c', nlags='auto')[1]
+            if p_value >= 0.05:
+                break
+            y = np.diff(y)
+            d += 1
+        return d
+
+    def forecast(self, y, forecast_look_ahead):
+        y = np.asarray(y, dtype=np.float64)
+        n = np.count_nonzero(~np.isnan(y))
+        d = self.differences(y)
+        trend = 'c' if d == 0 else 't' if d == 1 else 'n'
+
+        fits = []
+        for p, q in itertools.product(range(self.max_p + 1), range(self.max_q + 1)):
+            k = p + q + (trend != 'n') + 1  # Parameters, including the variance
+            if n - d - k - 1 <= 0:
+                continue  # Too short to fit (and to compute the AICc of) this model
+            try:
+                with warnings.catch_warnings():
+                    warnings.simplefilter('ignore')
+                    result = self._sarimax(y, order=(p, d, q), trend=trend).fit(disp=False)
+            except (ValueError, np.linalg.LinAlgError):
+                continue
+            aicc = result.aic + 2. * k * (k + 1) / (n - d - k - 1)
+            if np.isfinite(aicc):
+                fits.append((aicc, p, q, result))
+
+        # Models with a degenerate fit (e.g. a zero variance on very short series) have no confidence interval
+        for _, _, _, result in sorted(fits, key=lambda fit: fit[:3]):
+            prediction = _prediction(result.get_forecast(forecast_look_ahead))
+            if np.all(np.isfinite(prediction)):
+                return prediction
+        # Too short (or too irregular) for any of the models: fall back to a random walk
+        with warnings.catch_warnings():
+            warnings.simplefilter('ignore')
+            result = self._sarimax(y, order=(0, 1, 0)).fit(disp=False)
+        return _prediction(result.get_forecast(forecast_look_ahead))
+
+
+# Exponential smoothing (simple, Holt's linear trend or damped trend, whichever has the lowest AIC)
+class EtsBackend(ForecastBackend):
+
+    name = 'ets'
+
+    def __init__(self):
+        from statsmodels.tsa.statespace.exponential_smoothing import ExponentialSmoothing
+        self._ets = ExponentialSmoothing
+
+    def forecast(self, y, forecast_look_ahead):
+        y = np.asarray(y, dtype=np.float64)
+        best = None
+        for trend, damped in [(False, False), (True, False), (True, True)]:
+            try:
+                with warnings.catch_warnings():
+                    warnings.simplefilter('ignore')
+                    result = self._ets(y, trend=trend, damped_trend=damped).fit(disp=False)
+            except (ValueError, np.linalg.LinAlgError):
+                continue
+            if np.isfinite(result.aic) and (best is None or result.aic < best.aic):
+                best = result
+        if best is None:
+            raise ValueError('could not fit an exponential smoothing model to {} values'.format(len(y)))
+        return _prediction(best.get_forecast(forecast_look_ahead))
+
+
+# Backends whose models are fitted to all series at once by a forecaster of batch_forecast.py, which single forecasts
+# are computed with as well
+class BatchBackend(ForecastBackend):
+
+    model = None  # Name of the model, for errors
+
+    def forecast(self, y, forecast_look_ahead):
+        mean, upper_80, lower_80 = self.forecast_batch(np.asarray(y, dtype=np.float64)[None, :], forecast_look_ahead)
+        if np.isnan(mean[0, 0]):
+            raise ValueError('too few values to fit a {} model'.format(self.model))
+        return mean[0], upper_80[0], lower_80[0]
+
+
+# Additive Holt-Winters, fitted to all series at once by batch_forecast.holt_winters_forecast
+class HoltWintersBackend(BatchBackend):
+
+    name = 'hw'
+    model = 'Holt-Winters'
+
+    def forecast_batch(self, Y, forecast_look_ahead):
+        return batch_forecast.holt_winters_forecast(Y, forecast_look_ahead)
+
+
+# Linear trend, fitted to all series at once by batch_forecast.trend_forecast
+class TrendBackend(BatchBackend):
+
+    name = 'trend'
+    model = 'linear trend'
+
+    def forecast_batch(self, Y, forecast_look_ahead):
+        return batch_forecast.trend_forecast(Y, forecast_look_ahead)
+
+
+# auto.arima and forecast from the R 'forecast' package, through rpy2. R is initialized on the first forecast.
+class RBackend(ForecastBackend):
+
+    name = 'r'
+
+    def __init__(self):
+        self._r = None
+
+    def _init(self):
+        import rpy2.robjects.packages as rpackages
+        import rpy2.robjects as robjects
+        from rpy2.robjects.vectors import StrVector
+
+        # Preload/install packages for ARIMA forecasting
+        utils = rpackages.importr('utils')
+        package_names = ('stats', 'forecast')
+        names_to_install = [x for x in package_names if not rpackages.isinstalled(x)]
+        if len(names_to_install) > 0:
+            utils.chooseCRANmirror(ind=1)  # select the first mirror in the list
+            utils.install_packages(StrVector(names_to_install))
+        for name in package_names:
+            rpackages.importr(name)
+        self._r = robjects
+
+    def forecast(self, y, forecast_look_ahead):
+        if self._r is None:
+            self._init()
+        robjects = self._r
+
+        # Import functions required for ARIMA model from R
+        auto_arima = robjects.r('auto.arima')  # auto.arima function from forecast package
+        as_ts = robjects.r('ts')  # time-series class from stats package
+        forecast_fn = robjects.r('forecast')  # forecast function from forecast package
+
+        y_r = robjects.FloatVector(y)  # Define y_r as a float vector copy of y in the R environment
+        y_r = as_ts(y_r, frequency=12)  # Convert y_r to a time-series object
+        arima_model = auto_arima(y_r)  # Fit ARIMA model
+        fc = forecast_fn(arima_model, h=forecast_look_ahead)  # Forecast based on fitted ARIMA model
+
+        mean = np.array(fc.rx2('mean'))  # The mean of the ARIMA forecast
+        upper_80 = np.array([x[0] for x in np.array(fc.rx2('upper'))])  # Upper bound of 80% confidence interval
+        lower_80 = np.array([x[0] for x in np.array(fc.rx2('lower'))])  # Lower bound of 80% confidence interval
+
+        return mean, upper_80, lower_80
+
+
+# Mean, upper and lower 80% bounds of a statsmodels forecast
+def _prediction(forecast):
+    interval = np.asarray(forecast.conf_int(alpha=0.2))
+    return np.asarray(forecast.predicted_mean), interval[:, 1], interval[:, 0]
+
+
+backends = dict((cls.name, cls) for cls in [ArimaBackend, EtsBackend, HoltWintersBackend, TrendBackend, RBackend])
+
+backend_name = os.environ.get('MF_DASH_FORECAST_BACKEND', 'arima')
+if backend_name not in backends:
+    raise ValueError('Unknown forecasting backend {!r} (MF_DASH_FORECAST_BACKEND), expected one of {}'.format(
+        backend_name, ', '.join(sorted(backends))))
+backend = backends[backend_name]()
+
+
+# Forecast of the next forecast_look_ahead months of y with the selected backend: returns the mean of the forecast and
+# the upper and lower bounds of its 80% confidence interval.
+def arima_forecast(y, forecast_look_ahead):
+    return backend.forecast(y, forecast_look_ahead)
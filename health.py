@@ -0,0 +1,33 @@
+# Health endpoint for load balancers and monitoring: GET /health returns the version and load state of the data held by
+# the server process that answers, e.g.
+#     {"status": "ok", "data_version": "17bdb2ade829", "months": 69, "last_month": "2017-09", ...}
+# The status is 'ok', or 'stale' if the last check for new data (see ingest.py) failed; the data that is served is
+# still complete in that case, so the response code is 200 either way.
+import json
+import os
+import time
+
+from flask import Response
+
+import dataset
+import ingest
+from layout import app
+
+
+@app.server.route('/health')
+def health():
+    state = dataset.state
+    report = {'status': 'stale' if ingest.last_error else 'ok',
+              'pid': os.getpid(),
+              'data_version': state.version,
+              'loaded': time.strftime('%Y-%m-%dT%H:%M:%S', time.localtime(state.loaded)),
+              'variables': len(state.store.variables),
+              'branches': len(state.tree.branch_codes),
+              'months': len(state.store.months),
+              'last_month': state.store.months[-1] if state.store.months else None,
+              'data_mb': round(state.nbytes / 1e6, 1),
+              'ingest_interval': ingest.ingest_interval,
+              'last_ingest_check': ingest.last_check and time.strftime('%Y-%m-%dT%H:%M:%S',
+                                                                       time.localtime(ingest.last_check)),
+              'last_ingest_error': ingest.last_error}
+    return Response(json.dumps(report), mimetype='application/json')
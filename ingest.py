@@ -0,0 +1,117 @@
+# Ingestion of new monthly data while the server is running. refresh() checks whether the source files in
+# dataset.data_dir have changed since the current data was loaded. If months were only appended to dabi_global.csv
+# (the branchlist is unchanged, and every row of the new file starts with the same fields as the file the current data
+# was read from, which is checked against the row hash in its fingerprint, see data_cache.csv_fingerprint), only the
+# new month columns are parsed and appended to the array store (see DrabStore.append_months). Otherwise, e.g. if the
+# values of earlier months were revised as well, all data is loaded again.
+# Either way the new data is built next to the current one and swapped in as dataset.state once it is complete, so
+# requests that are running meanwhile keep using the old data. The data version changes with it, so memoized results,
+# stored scatter results and cached forecasts of the old data are no longer used.
+#
+# start() runs refresh() every ingest_interval seconds in a background thread.
+import os
+import threading
+import time
+
+import pandas as pd
+
+import data_cache
+import dataset
+
+# Seconds between checks for new data, 0 to disable them. Can be set with the MF_DASH_INGEST_INTERVAL environment
+# variable.
+ingest_interval = float(os.environ.get('MF_DASH_INGEST_INTERVAL', 300))
+
+_lock = threading.Lock()
+
+# Time of the last check for new data by the background thread, and the error it raised (None if it succeeded)
+last_check = None
+last_error = None
+
+
+# Load the source files if they have changed, and replace dataset.state. Returns True if the data was replaced.
+def refresh():
+    with _lock:
+        state = dataset.state
+        changed = data_cache.changed_sources(dataset.data_dir, state.sources)
+        if not changed:
+            return False
+        sources = data_cache.source_fingerprints(dataset.data_dir)
+        if all(sources[name]['sha1'] == state.sources[name]['sha1'] for name in changed):
+            # Touched but not changed, the data version stays the same (and so do the row hashes)
+            state.sources = dict((name, dict(state.sources[name], **sources[name])) for name in sources)
+            return False
+
+        start = time.time()
+        new_state = None
+        if data_cache.read(dataset.data_dir, dataset.cache_dir):
+            # Another server process has already ingested the new data, use its (shared, memory-mapped) data cache
+            new_state = dataset.load(dataset.data_dir, dataset.cache_dir)
+            how = 'Loaded new data from the data cache'
+        elif changed == ['dabi_global.csv']:
+            new_state = _append_months(state, sources)
+            how = 'Appended new months'
+        if new_state is None:
+            new_state = dataset.load(dataset.data_dir, dataset.cache_dir)
+            how = 'Reloaded all data'
+
+        dataset.state = new_state
+        print('{} in {:.2f}s, now {} months (data version {} -> {})'.format(
+            how, time.time() - start, len(new_state.store.months), state.version, new_state.version))
+        return True
+
+
+# A new state with the months that were added to dabi_global.csv appended to state, or None if the file did not only
+# gain months
+def _append_months(state, sources):
+    old = state.sources['dabi_global.csv']
+    if 'rows_sha1' not in old:
+        return None  # The rows of the current data are not known, e.g. because the data cache could not be written
+    path = os.path.join(dataset.data_dir, 'dabi_global.csv')
+    fingerprint = data_cache.csv_fingerprint(path, prefix_columns=old['columns'])
+    if fingerprint['sha1'] != sources['dabi_global.csv']['sha1'] or fingerprint['prefix_sha1'] != old['rows_sha1']:
+        return None  # The existing columns changed as well (or the file changed again meanwhile)
+    del fingerprint['prefix_sha1']
+
+    columns = list(pd.read_csv(path, nrows=0).columns[1:])
+    months = [c for c in columns if c not in ('branch_code', 'variable')]
+    n_months = len(state.store.months)
+    if len(months) <= n_months or months[:n_months] != state.store.months:
+        return None
+
+    frame = pd.read_csv(path, usecols=['branch_code', 'variable'] + months[n_months:])
+    if data_cache.changed_sources(dataset.data_dir, dict(sources, **{'dabi_global.csv': fingerprint})):
+        return None  # Changed while it was being read
+    sources = dict(sources, **{'dabi_global.csv': fingerprint})
+    store = state.store.append_months(frame[['branch_code', 'variable'] + months[n_months:]])
+    try:
+        meta = data_cache.write(dataset.data_dir, dataset.cache_dir, state.branchlist, store, sources)
+        # Use the memory-mapped cache rather than the arrays just built, so that this process shares the data with
+        # the processes that load it from the cache
+        store = store.remapped(zip(meta['variables'], data_cache.mapped_values(dataset.cache_dir)))
+    except (IOError, OSError) as e:
+        print('Could not write data cache to {}: {}'.format(dataset.cache_dir, e))
+    return dataset.DataState(state.branchlist, state.tree, store, sources)
+
+
+# Run refresh() every interval seconds in a daemon thread. Returns the thread, or None if interval is 0.
+def start(interval=ingest_interval):
+    if not interval:
+        return None
+
+    def run():
+        global last_check, last_error
+        while True:
+            time.sleep(interval)
+            try:
+                refresh()
+                last_error = None
+            except Exception as e:  # E.g. a file that is still being written, we try again next time
+                last_error = repr(e)
+                print('Could not ingest new data from {}: {}'.format(dataset.data_dir, last_error))
+            last_check = time.time()
+
+    thread = threading.Thread(target=run, name='ingest')
+    thread.daemon = True
+    thread.start()
+    return thread
@@ -0,0 +1,212 @@
+# Instrumentation of the dash callbacks. instrument(app) (called in layout.py, before any callback is registered) wraps
+# every function registered with @app.callback, and records for every callback request:
+# - the wall time of the whole request, from receiving it to having the response ready,
+# - the time spent in stages of the callback, which are marked in the callbacks with
+#       with stage('aggregation'):
+#           results = query_batch(...)
+#   (the stages used are aggregation, forecasting and figure), and the time from the callback returning to the response
+#   being ready, as the 'serialization' stage (dash turning the result into JSON),
+# - the size of the response (before compression), and
+# - the number of callbacks that raised an error.
+# GET /metrics returns these as Prometheus histograms and counters, along with the hit and miss counts of the memoized
+# callbacks (see memoize.py) and of the forecast and result caches. Metrics are kept per server process.
+#
+# Callbacks that take longer than MF_DASH_SLOW_CALLBACK seconds (default 0: no logging) are logged with their stage
+# timings and arguments.
+import functools
+import os
+import threading
+import timeit
+from contextlib import contextmanager
+
+from dash.exceptions import PreventUpdate
+from flask import Response, request
+
+slow_callback = float(os.environ.get('MF_DASH_SLOW_CALLBACK', 0))
+
+time_buckets = (.005, .01, .025, .05, .1, .25, .5, 1, 2.5, 5, 10, 30)  # Seconds
+size_buckets = (1e3, 1e4, 1e5, 1e6, 1e7)  # Bytes
+
+_local = threading.local()  # The record of the callback request handled by the current thread
+
+
+def _labels(names, values):
+    escaped = [str(v).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for v in values]
+    return ','.join('{}="{}"'.format(name, value) for name, value in zip(names, escaped))
+
+
+def _number(value):
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+# Prometheus histogram with the given label names. observe() takes a tuple of label values.
+class Histogram(object):
+
+    def __init__(self, name, help, labels, buckets):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self.buckets = buckets
+        self._series = {}  # label values -> [count per bucket (and above the last one), sum]
+        self._lock = threading.Lock()
+
+    def observe(self, label_values, value):
+        with self._lock:
+            series = self._series.get(label_values)
+            if series is None:
+                series = self._series[label_values] = [[0] * (len(self.buckets) + 1), 0.]
+            series[0][sum(value > bound for bound in self.buckets)] += 1
+            series[1] += value
+
+    def render(self):
+        lines = ['# HELP {} {}'.format(self.name, self.help), '# TYPE {} histogram'.format(self.name)]
+        with self._lock:
+            series = sorted((values, list(counts), total) for values, (counts, total) in self._series.items())
+        for values, counts, total in series:
+            labels = _labels(self.labels, values)
+            cumulative = 0
+            for bound, count in zip(list(self.buckets) + ['+Inf'], counts):
+                cumulative += count
+                lines.append('{}_bucket{{{}{}le="{}"}} {}'.format(self.name, labels, ',' if labels else '',
+                                                                 bound, cumulative))
+            lines.append('{}_sum{{{}}} {}'.format(self.name, labels, _number(total)))
+            lines.append('{}_count{{{}}} {}'.format(self.name, labels, cumulative))
+        return lines
+
+
+# Prometheus counter with the given label names
+class Counter(object):
+
+    def __init__(self, name, help, labels):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, label_values, amount=1):
+        with self._lock:
+            self._values[label_values] = self._values.get(label_values, 0) + amount
+
+    def render(self):
+        lines = ['# HELP {} {}'.format(self.name, self.help), '# TYPE {} counter'.format(self.name)]
+        with self._lock:
+            values = sorted(self._values.items())
+        for label_values, value in values:
+            lines.append('{}{{{}}} {}'.format(self.name, _labels(self.labels, label_values), _number(value)))
+        return lines
+
+
+request_seconds = Histogram('mf_dash_callback_seconds', 'Wall time of callback requests.', ('callback',),
+                            time_buckets)
+stage_seconds = Histogram('mf_dash_callback_stage_seconds', 'Time spent in each stage of callback requests.',
+                          ('callback', 'stage'), time_buckets)
+response_bytes = Histogram('mf_dash_callback_response_bytes', 'Size of callback responses (before compression).',
+                           ('callback',), size_buckets)
+errors = Counter('mf_dash_callback_errors_total', 'Callbacks that raised an error.', ('callback',))
+
+
+# Count the time spent in the with block towards stage name of the current callback request (if any)
+@contextmanager
+def stage(name):
+    record = getattr(_local, 'record', None)
+    start = timeit.default_timer()
+    try:
+        yield
+    finally:
+        if record is not None:
+            record['stages'][name] = record['stages'].get(name, 0) + timeit.default_timer() - start
+
+
+def _wrap(func):
+    name = '{}.{}'.format(func.__module__, func.__name__)
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        record = getattr(_local, 'record', None)
+        if record is None:  # Not called for a callback request, e.g. by benchmark.py
+            return func(*args, **kwargs)
+        record['callback'] = name
+        record['args'] = args
+        try:
+            return func(*args, **kwargs)
+        except PreventUpdate:
+            raise
+        except Exception:
+            errors.inc((name,))
+            raise
+        finally:
+            record['returned'] = timeit.default_timer()
+    return wrapper
+
+
+def _before_request():
+    _local.record = None
+    if request.path.endswith('_dash-update-component'):
+        _local.record = {'start': timeit.default_timer(), 'stages': {}}
+
+
+def _after_request(response):
+    record, _local.record = getattr(_local, 'record', None), None
+    if record is None or 'callback' not in record:
+        return response
+    now = timeit.default_timer()
+    name = record['callback']
+    if response.status_code == 200:
+        record['stages']['serialization'] = now - record['returned']
+    total = now - record['start']
+    size = response.calculate_content_length() or 0
+
+    request_seconds.observe((name,), total)
+    response_bytes.observe((name,), size)
+    for stage_name, seconds in record['stages'].items():
+        stage_seconds.observe((name, stage_name), seconds)
+
+    if slow_callback and total > slow_callback:
+        print('Slow callback {} took {:.3f}s ({}), {} bytes, arguments {}'.format(
+            name, total, ', '.join('{} {:.3f}s'.format(k, v) for k, v in sorted(record['stages'].items())), size,
+            repr(record['args'])[:1000]))
+    return response
+
+
+def _teardown_request(exception):
+    _local.record = None
+
+
+# GET /metrics: the metrics above and the cache hit counts, in the Prometheus text format
+def metrics():
+    import forecast_cache
+    import memoize
+    import result_store
+
+    lines = []
+    for metric in [request_seconds, stage_seconds, response_bytes, errors]:
+        lines.extend(metric.render())
+
+    memoized = Counter('mf_dash_memoize_requests_total', 'Calls of memoized callbacks, by result.',
+                       ('function', 'result'))
+    for function, counts in memoize.stats().items():
+        memoized.inc((function, 'hit'), counts['hits'])
+        memoized.inc((function, 'miss'), counts['misses'])
+    caches = Counter('mf_dash_cache_requests_total', 'Lookups in the forecast and result caches, by result.',
+                     ('cache', 'result'))
+    for cache_name, counts in [('forecast', forecast_cache.stats()), ('result', result_store.stats())]:
+        caches.inc((cache_name, 'hit'), counts['hits'])
+        caches.inc((cache_name, 'miss'), counts['misses'])
+    lines.extend(memoized.render() + caches.render())
+    return Response('\n'.join(lines) + '\n', content_type='text/plain; version=0.0.4; charset=utf-8')
+
+
+# Instrument every callback registered with app from now on, and add the /metrics endpoint to its server
+def instrument(app):
+    register = app.callback
+
+    def callback(*args, **kwargs):
+        decorator = register(*args, **kwargs)
+        return lambda func: decorator(_wrap(func))
+
+    app.callback = callback
+    app.server.before_request(_before_request)
+    app.server.after_request(_after_request)
+    app.server.teardown_request(_teardown_request)
+    app.server.add_url_rule('/metrics', 'metrics', metrics)
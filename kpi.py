@@ -0,0 +1,56 @@
+# KPI engine for the at-a-glance panel. All KPIs are computed element-wise over (nodes x months) arrays, so any number
+# of DRAB nodes is handled in a single call.
+from __future__ import division
+
+import numpy as np
+
+# Variables the KPIs are computed from
+kpi_vars = ['Current OD Tk.', 'Total Current OS Tk.',
+            'Total OD [Excl.NL2] Tk.', 'Total OS [Excl.NL2] Tk.',
+            'Current Borrowers', 'Amount Disbursed (Month) Tk.']
+
+# KPIs, in the order they are returned (and shown in the at-a-glance table)
+kpi_names = ['Current Borrowers', 'Monthly Disbursement', 'Current OD/OS%', 'Total OD/OS% [Excl. NL2]']
+
+
+# (nodes x KPIs x months) array with the KPI series of every node
+def kpi_series(store, nodes):
+    return kpis_from_sums(np.stack([store.node_aggregates(v, nodes, 'sum') for v in kpi_vars], axis=1))
+
+
+# KPIs that are totals over the branches of a DRAB, and so grow with its size: their index in kpi_names and the variable
+# they add up
+kpi_totals = [(0, 'Current Borrowers'), (1, 'Amount Disbursed (Month) Tk.')]
+
+
+# (nodes x KPIs x months) array with the KPI series of every node per branch, for comparing nodes of different sizes:
+# totals are averaged over the branches of a node (as the variables are for their ranks), the OD/OS ratios are kept
+def kpi_branch_series(store, nodes):
+    series = kpi_series(store, nodes)
+    for k, variable in kpi_totals:
+        series[:, k] = store.node_aggregates(variable, nodes, 'mean')
+    return series
+
+
+# KPI series from a (nodes x kpi_vars x months) array with the sums of kpi_vars, as a (nodes x KPIs x months) array
+def kpis_from_sums(sums):
+    current_od, current_os, od, os, borrowers, disbursement = [sums[:, i] for i in range(len(kpi_vars))]
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return np.stack([borrowers, disbursement, current_od / current_os, od / os], axis=1)
+
+
+# Value of every KPI for every node at the given month (default: the latest), and its % change over the last 12 months
+# (i.e. compared to the twelfth-to-last month). Returns two (nodes x KPIs) arrays.
+def compute_kpis(store, nodes, month=-1):
+    return annual_change(kpi_series(store, nodes), month)
+
+
+# Value at the given month and % change over the last 12 months of a (nodes x KPIs x months) array of KPI series
+def annual_change(series, month=-1):
+    month = month % series.shape[2]
+    present = series[:, :, month]
+    if month < 11:
+        return present, np.full(present.shape, np.nan)
+    past = series[:, :, month - 11]
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return present, 100 * (present - past) / past
@@ -1,24 +1,66 @@
 import dash
 import dash_core_components as dcc
 import dash_html_components as html
+import json
 import pandas as pd
 
+import dataset
+from drab_tree import drab_levels
+from instrument import instrument
+
 global app
 app = dash.Dash()
+instrument(app)  # Timings of every callback registered from here on, see instrument.py
 
-# Preliminary data loading, extracting DRAB names, etc.
-df_main = pd.read_csv('../../Documents/BRAC/MF/MF Branch Data/Data/dabi_global.csv')
-df_main = df_main[df_main.columns[1:]]
-branchlist = pd.read_csv('../../Documents/BRAC/MF/MF Branch Data/Data/branchlist.csv')
-dates = pd.date_range('2012/01/01', freq='M', periods=12 * 5 + 9)
-
+# Data loading is done once in dataset.py and shared with all callback modules. The current data (dataset.state) can be
+# replaced while the server is running (see ingest.py), so everything derived from it, e.g. DRAB names and the dates of
+# the timeframe slider, is extracted when the layout is served, i.e. on every page load.
 
-variable_names = df_main['variable'].unique()
-variable_options = [{'label': variable_names[i], 'value': variable_names[i]} for i in range(len(variable_names))]
-agg_level_names = branchlist.columns
+agg_level_names = dataset.state.branchlist.columns
 agg_level_options = [{'label': agg_level_names[i], 'value': agg_level_names[i]} for i in range(len(agg_level_names))]
-division_options = [{'label': k, 'value': k} for k in branchlist['Division'].unique()]
-division_options.append({'label': 'Global', 'value': 'Global'})
+
+
+def variable_options(state=None):
+    variable_names = (state or dataset.state).store.variables
+    return [{'label': variable_names[i], 'value': variable_names[i]} for i in range(len(variable_names))]
+
+
+def division_options(state=None):
+    options = list((state or dataset.state).tree.options[0])  # Children of the Global root
+    options.append({'label': 'Global', 'value': 'Global'})
+    return options
+
+
+# Up to max_compare DRABs (of any level) can be compared in the 'Compare many' tab. They are selected by their path of
+# names (as JSON, see compare_value), which unlike node ids stays valid when the branchlist changes.
+max_compare = 10
+
+
+def compare_value(path):
+    return json.dumps(list(path))
+
+
+# The DRAB (as in the DRAB selectors) of a value of the compare_nodes dropdown
+def compare_drab(value):
+    path = json.loads(value)
+    return path + [None] * (len(drab_levels) - len(path))
+
+
+# Options of the compare_nodes dropdown: the DRABs above Branch level and, to keep the page small, only the branches of
+# the area of the given DRAB (the primary selection), along with the selected values
+def compare_options(state=None, drab=None, selected=()):
+    tree = (state or dataset.state).tree
+    nodes = [node for node in range(len(tree.path)) if tree.level[node] != 'Branch']
+    if drab and drab[2]:
+        area = tree.ids.get(tuple(drab[:3]))
+        nodes.extend(tree.children[area] if area is not None else [])
+    for value in selected or []:
+        node = tree.ids.get(tuple(json.loads(value)))
+        if node is not None and node not in nodes:
+            nodes.append(node)
+    return [{'label': '{}: {}'.format(tree.level[node], ' / '.join(tree.path[node])) if node else 'Global',
+             'value': compare_value(tree.path[node])} for node in nodes]
+
 
 # Custom CSS styling
 app.css.append_css({'external_url': 'https://codepen.io/luke-scholtes/pen/xprjoK.css'})
@@ -40,195 +82,220 @@ colors = {
     'light BRAC pink': '#ed0083'
 }
 
-# Dash layout
-app.layout = html.Div(style={'font-family': 'Verdana, sans-serif'},
-                      children=[
-    # Upper Div
-    html.Div([
 
-        # Define Location
+# Dash layout, built from the current data on every page load
+def serve_layout():
+    state = dataset.state
+    dates = state.dates
+
+    return html.Div(style={'font-family': 'Verdana, sans-serif'},
+                          children=[
+        # Upper Div
         html.Div([
-            # Tabs
-            html.Div([
-                dcc.Tabs(
-                    tabs=[
-                        {'label': 'Single', 'value': 1},
-                        {'label': 'Compare', 'value': 2}
-                    ],
-                    id='drab_tabs',
-                    value=1
-                )
-            ]),
-            # DRAB selection
+
+            # Define Location
             html.Div([
-                # DRAB, text only
+                # Tabs
                 html.Div([
-                    html.Div(['Division'], style={'display': 'block', 'margin-top': 0}),
-                    html.Div(['Region'], style={'display': 'block', 'margin-top': 20}),
-                    html.Div(['Area'], style={'display': 'block', 'margin-top': 20}),
-                    html.Div(['Branch'], style={'display': 'block', 'margin-top': 20})
-                ],
-                    style={'width': '15%', 'color': colors['white'], 'display': 'inline-block', 'vertical-align': 'middle'}),
-                # Primary DRAB dropdown
+                    dcc.Tabs(
+                        tabs=[
+                            {'label': 'Single', 'value': 1},
+                            {'label': 'Compare', 'value': 2},
+                            {'label': 'Compare many', 'value': 3}
+                        ],
+                        id='drab_tabs',
+                        value=1
+                    )
+                ]),
+                # DRAB selection
                 html.Div([
+                    # DRAB, text only
                     html.Div([
-                        dcc.Dropdown(id='division',
-                                     options=division_options,
-                                     value='Global')],
-                            style={'display': 'block', 'vertical-align': 'middle', 'margin-top': 3}),
+                        html.Div(['Division'], style={'display': 'block', 'margin-top': 0}),
+                        html.Div(['Region'], style={'display': 'block', 'margin-top': 20}),
+                        html.Div(['Area'], style={'display': 'block', 'margin-top': 20}),
+                        html.Div(['Branch'], style={'display': 'block', 'margin-top': 20})
+                    ],
+                        style={'width': '15%', 'color': colors['white'], 'display': 'inline-block', 'vertical-align': 'middle'}),
+                    # Primary DRAB dropdown
                     html.Div([
-                        dcc.Dropdown(id='region')],
-                            style={'display': 'block', 'vertical-align': 'middle', 'margin-top': 3}),
+                        html.Div([
+                            dcc.Dropdown(id='division',
+                                         options=division_options(state),
+                                         value='Global')],
+                                style={'display': 'block', 'vertical-align': 'middle', 'margin-top': 3}),
+                        html.Div([
+                            dcc.Dropdown(id='region')],
+                                style={'display': 'block', 'vertical-align': 'middle', 'margin-top': 3}),
+                        html.Div([
+                                dcc.Dropdown(id='area')],
+                                style={'display': 'block', 'vertical-align': 'middle', 'margin-top': 3}),
+                        html.Div([
+                                dcc.Dropdown(id='branch')],
+                                style={'display': 'block', 'vertical-align': 'middle', 'margin-top': 3})
+                    ],
+                        id='primary_drab',
+                        ),
+                    # Secondary DRAB dropdown
                     html.Div([
-                            dcc.Dropdown(id='area')],
-                            style={'display': 'block', 'vertical-align': 'middle', 'margin-top': 3}),
+                        html.Div([
+                            dcc.Dropdown(id='division2',
+                                         options=division_options(state),
+                                         value='Global')],
+                                style={'display': 'block', 'vertical-align': 'middle', 'margin-top': 3}),
+                        html.Div([
+                                dcc.Dropdown(id='region2')],
+                                style={'display': 'block', 'vertical-align': 'middle', 'margin-top': 3}),
+                        html.Div([
+                                dcc.Dropdown(id='area2')],
+                                style={'display': 'block', 'vertical-align': 'middle', 'margin-top': 3}),
+                        html.Div([
+                                dcc.Dropdown(id='branch2')],
+                                style={'display': 'block', 'vertical-align': 'middle', 'margin-top': 3})
+                    ],
+                        id='secondary_drab',
+                        ),
+                    # N-way comparison: any DRABs, e.g. all areas of a region or a few hand-picked branches
                     html.Div([
-                            dcc.Dropdown(id='branch')],
-                            style={'display': 'block', 'vertical-align': 'middle', 'margin-top': 3})
-                ],
-                    id='primary_drab',
-                    ),
-                # Secondary DRAB dropdown
+                        dcc.Dropdown(id='compare_nodes',
+                                     options=compare_options(state),
+                                     multi=True,
+                                     value=[],
+                                     placeholder='DRABs to compare (up to {})'.format(max_compare)),
+                        html.Button('Add sub-DRABs of selection', id='compare_children', n_clicks=0,
+                                    style={'margin-top': 3})
+                    ],
+                        id='compare_drabs',
+                        style={'display': 'none'}
+                        )
+                ])
+            ],
+                style={'width': '35%', 'display': 'inline-block', 'margin-top': 10, 'margin-bottom': 10, 'margin-left': 10}),
+
+            # Variable Selection
+            html.Div([
+                # Primary Variable
                 html.Div([
-                    html.Div([
-                        dcc.Dropdown(id='division2',
-                                     options=division_options,
-                                     value='Global')],
-                            style={'display': 'block', 'vertical-align': 'middle', 'margin-top': 3}),
-                    html.Div([
-                            dcc.Dropdown(id='region2')],
-                            style={'display': 'block', 'vertical-align': 'middle', 'margin-top': 3}),
-                    html.Div([
-                            dcc.Dropdown(id='area2')],
-                            style={'display': 'block', 'vertical-align': 'middle', 'margin-top': 3}),
-                    html.Div([
-                            dcc.Dropdown(id='branch2')],
-                            style={'display': 'block', 'vertical-align': 'middle', 'margin-top': 3})
-                ],
-                    id='secondary_drab',
-                    )
-            ])
+                    html.Div('Variable:', style={'color': colors['white']}),
+                    dcc.Dropdown(id='variable',
+                                 options=variable_options(state),
+                                 value=variable_options(state)[0]['value']),
+                    dcc.Checklist(id='show_all_opts',
+                                  options=[{'label': 'Show all', 'value': 'show_all'}],
+                                  values=[],
+                                  style={'color': colors['white']})],
+                    style={'margin-bottom': 20}),
+                # Secondary Variable
+                html.Div([
+                    html.Div('Secondary Variable:', style={'color': colors['white']}),
+                    dcc.Dropdown(id='sec_variable',
+                                 options=variable_options(state),
+                                 value=None)])
+            ], style={'width': '20%', 'vertical-align': 'center', 'display': 'inline-block', 'margin-left': 30,
+                      'margin-bottom': 10, 'margin-top': 10}),
+
+            # Primary location basic information
+            html.Div(
+                id='at_a_glance',
+                style={'width': '40%', 'display': 'inline-block', 'vertical-align': 'bottom', 'float': 'right',
+                       'backgroundColor': colors['BRAC pink'], 'color': colors['white'], 'margin-bottom': 10,
+                       'margin-top': 10, 'margin-right': 10})
+
         ],
-            style={'width': '35%', 'display': 'inline-block', 'margin-top': 10, 'margin-bottom': 10, 'margin-left': 10}),
+            style={'width': '100%', 'backgroundColor': colors['light BRAC pink']}),
 
-        # Variable Selection
-        html.Div([
-            # Primary Variable
-            html.Div([
-                html.Div('Variable:', style={'color': colors['white']}),
-                dcc.Dropdown(id='variable',
-                             options=variable_options,
-                             value=variable_options[0]['value']),
-                dcc.Checklist(id='show_all_opts',
-                              options=[{'label': 'Show all', 'value': 'show_all'}],
-                              values=[],
-                              style={'color': colors['white']})],
-                style={'margin-bottom': 20}),
-            # Secondary Variable
-            html.Div([
-                html.Div('Secondary Variable:', style={'color': colors['white']}),
-                dcc.Dropdown(id='sec_variable',
-                             options=variable_options,
-                             value=None)])
-        ], style={'width': '20%', 'vertical-align': 'center', 'display': 'inline-block', 'margin-left': 30,
-                  'margin-bottom': 10, 'margin-top': 10}),
-
-        # Primary location basic information
-        html.Div(
-            id='at_a_glance',
-            style={'width': '40%', 'display': 'inline-block', 'vertical-align': 'bottom', 'float': 'right',
-                   'backgroundColor': colors['BRAC pink'], 'color': colors['white'], 'margin-bottom': 10,
-                   'margin-top': 10, 'margin-right': 10})
-
-    ],
-        style={'width': '100%', 'backgroundColor': colors['light BRAC pink']}),
-
-    # Split div (aesthetic)
-    # html.Hr(
-    #          style={'height': 10, 'margin-bottom': 10, 'backgroundColor': colors['light-grey'],
-    #                 'width': '100%', 'border': 'none'}),
-
-
-    # Graphs
-    html.Div([
-        # Time-Series graph + options + timeframe
+        # Split div (aesthetic)
+        # html.Hr(
+        #          style={'height': 10, 'margin-bottom': 10, 'backgroundColor': colors['light-grey'],
+        #                 'width': '100%', 'border': 'none'}),
+
+
+        # Graphs
         html.Div([
-            # Timeframe selector
+            # Time-Series graph + options + timeframe
             html.Div([
-                dcc.RangeSlider(id='timeframe',
-                                marks={i: dates[i] for i in range(len(dates)) if i % 12 == 0},
-                                min=0,
-                                max=len(dates),
-                                value=[len(dates)-24, len(dates)]),
-            ],
-                style={'margin-bottom': 20, 'margin-left': 40, 'margin-right': 40}),
-            # Graph + options
-            html.Div([
-                # Overlay options
+                # Timeframe selector
                 html.Div([
-                    # Mean overlay options
-                    html.Div([
-                        html.Div(['Average:'], style={'font-weight': 'bold', 'color': colors['white']}),
-                        dcc.Checklist(id='mean_options',
-                                      options=[{'label': 'Global', 'value': 'glbm'},
-                                               {'label': 'Division', 'value': 'divm'},
-                                               {'label': 'Region', 'value': 'regm'},
-                                               {'label': 'Area', 'value': 'arem'}],
-                                      values=[],
-                                      style={'display': 'block', 'color': colors['white']})
-                    ],
-                        id='mean_overlay_options',
-                        style={'padding-bottom': 10, 'padding-left': 8, 'backgroundColor': colors['BRAC pink']}),
-                    # Forecast options
+                    dcc.RangeSlider(id='timeframe',
+                                    marks={i: dates[i] for i in range(len(dates)) if i % 12 == 0},
+                                    min=0,
+                                    max=len(dates),
+                                    value=[len(dates)-24, len(dates)]),
+                ],
+                    style={'margin-bottom': 20, 'margin-left': 40, 'margin-right': 40}),
+                # Graph + options
+                html.Div([
+                    # Overlay options
                     html.Div([
-                        html.Div(['Analysis:'], style={'font-weight': 'bold', 'color': colors['white']}),
-                        dcc.Checklist(id='forecast_options',
-                                      options=[  # {'label': 'Smoothing', 'value': 'smth'},
-                                          {'label': 'Trend', 'value': 'linear_pred'},
-                                          {'label': 'Forecast', 'value': 'arima_pred'}],
-                                      values=[],
-                                      style={'color': colors['white']}),
-                        html.P(['Forecast for'], style={'color': colors['white']}),
+                        # Mean overlay options
                         html.Div([
-                            dcc.Dropdown(id='forecast_look_ahead',
-                                         options=[{'label': i, 'value': i} for i in [3, 6, 9, 12]],
-                                         value=6)],
-                                 style={'width': '50%'}),
-                        html.P(['months, based on past'], style={'color': colors['white']}),
+                            html.Div(['Average:'], style={'font-weight': 'bold', 'color': colors['white']}),
+                            dcc.Checklist(id='mean_options',
+                                          options=[{'label': 'Global', 'value': 'glbm'},
+                                                   {'label': 'Division', 'value': 'divm'},
+                                                   {'label': 'Region', 'value': 'regm'},
+                                                   {'label': 'Area', 'value': 'arem'}],
+                                          values=[],
+                                          style={'display': 'block', 'color': colors['white']})
+                        ],
+                            id='mean_overlay_options',
+                            style={'padding-bottom': 10, 'padding-left': 8, 'backgroundColor': colors['BRAC pink']}),
+                        # Forecast options
                         html.Div([
-                            dcc.Dropdown(id='forecast_look_back',
-                                         options=[{'label': i, 'value': i} for i in [6, 12, 24, 'all']],
-                                         value=12)],
-                                 style={'width': '50%'}),
-                        html.P(['months.'], style={'color': colors['white']})
+                            html.Div(['Analysis:'], style={'font-weight': 'bold', 'color': colors['white']}),
+                            dcc.Checklist(id='forecast_options',
+                                          options=[  # {'label': 'Smoothing', 'value': 'smth'},
+                                              {'label': 'Trend', 'value': 'linear_pred'},
+                                              {'label': 'Forecast', 'value': 'arima_pred'}],
+                                          values=[],
+                                          style={'color': colors['white']}),
+                            html.P(['Forecast for'], style={'color': colors['white']}),
+                            html.Div([
+                                dcc.Dropdown(id='forecast_look_ahead',
+                                             options=[{'label': i, 'value': i} for i in [3, 6, 9, 12]],
+                                             value=6)],
+                                     style={'width': '50%'}),
+                            html.P(['months, based on past'], style={'color': colors['white']}),
+                            html.Div([
+                                dcc.Dropdown(id='forecast_look_back',
+                                             options=[{'label': i, 'value': i} for i in [6, 12, 24, 'all']],
+                                             value=12)],
+                                     style={'width': '50%'}),
+                            html.P(['months.'], style={'color': colors['white']})
+                        ],
+                            style={'padding-bottom': 10, 'padding-left': 8, 'backgroundColor': colors['light BRAC pink']})
                     ],
-                        style={'padding-bottom': 10, 'padding-left': 8, 'backgroundColor': colors['light BRAC pink']})
-                ],
-                    style={'width': '13%', 'display': 'inline-block', 'vertical-align': 'top',
-                           'margin-top': 20}),
+                        style={'width': '13%', 'display': 'inline-block', 'vertical-align': 'top',
+                               'margin-top': 20}),
 
-                # Main time series graph
-                html.Div([
-                    dcc.Graph(id='main_graph')
-                ],
-                    style={'width': '87%', 'display': 'inline-block'})
+                    # Main time series graph
+                    html.Div([
+                        dcc.Graph(id='main_graph')
+                    ],
+                        style={'width': '87%', 'display': 'inline-block'})
 
-            ])
-        ], id='main_graph_div'),
-        # Scatter plot + options
-        html.Div([
-            # Scatter plot options
-            dcc.Checklist(id='scatter_options',
-                          options=[{'label': 'R-Squared (Scatter)', 'value': 'rsquare'},
-                                   {'label': 'Quantile Trim', 'value': 'quant_trim'}],
-                          values=['quant_trim']),
-            # Scatter plot
-            dcc.Graph(id='scatter_graph'),
-            html.Div(id='lin_regn_coeffs', style={'margin-top': 10})
-        ], id='scatter_graph_div')
-    ],
-        style={'width': '100%', 'margin-top': 10}),
-
-    # Hidden divs for variable/data sharing between callback functions
-    html.Div(id='scatter_calc', style={'display': 'none'}),  # Data loading/calculations for scatter plot
-])
\ No newline at end of file
+                ])
+            ], id='main_graph_div'),
+            # Scatter plot + options
+            html.Div([
+                # Scatter plot options
+                dcc.Checklist(id='scatter_options',
+                              options=[{'label': 'R-Squared (Scatter)', 'value': 'rsquare'},
+                                       {'label': 'Quantile Trim', 'value': 'quant_trim'}],
+                              values=['quant_trim']),
+                # Scatter plot
+                dcc.Graph(id='scatter_graph'),
+                html.Div(id='lin_regn_coeffs', style={'margin-top': 10})
+            ], id='scatter_graph_div')
+        ],
+            style={'width': '100%', 'margin-top': 10}),
+
+        # Hidden divs for variable/data sharing between callback functions
+        html.Div(id='scatter_calc', style={'display': 'none'}),  # Data loading/calculations for scatter plot
+        html.Div(id='forecast_status', style={'display': 'none'}, children='ready'),  # Whether forecasts are still running
+        # Polls forecast_status while it is pending
+        dcc.Interval(id='forecast_poll', interval=2000, n_intervals=0, disabled=True),
+    ])
+
+
+app.layout = serve_layout
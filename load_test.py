@@ -0,0 +1,305 @@
+# Load test: replays scripted dashboard sessions against the callback endpoint (_dash-update-component) of a running
+# server, with an increasing number of concurrent users, and reports the throughput, the latency percentiles of every
+# callback and the error rate at each level of concurrency:
+#
+#     MF_DASH_DATA_DIR=/tmp/mf-data python serve.py &    # e.g. on synthetic data, see synthetic_data.py
+#     python load_test.py --url http://127.0.0.1:8050 --concurrency 1 4 16 --duration 60 --output load.json
+#
+# or let it generate synthetic data (as benchmark.py does) and start the server with serve.py itself:
+#     python load_test.py --serve medium --concurrency 1 4 16
+#
+# Every simulated user behaves like the dashboard page in a browser: it loads the layout and the callback graph
+# (_dash-layout and _dash-dependencies), fires all callbacks on page load, and after every interaction fires the
+# callbacks whose inputs changed, then the callbacks whose inputs were changed by those, and so on. The scripted session
+# picks a division and drills down to a branch, turns on the trend and forecast (and polls the forecast status),
+# switches to the Compare tab and picks a second division, and chooses a secondary variable, waiting up to --think
+# seconds between steps. Users repeat the session with other random choices until --duration seconds are up.
+from __future__ import division
+
+import argparse
+import json
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import timeit
+from collections import OrderedDict
+
+import numpy as np
+
+try:
+    from http.client import HTTPConnection
+    from urllib.parse import urlparse
+except ImportError:  # Python 2
+    from httplib import HTTPConnection
+    from urlparse import urlparse
+
+
+# Latencies and errors of the callback requests made at one level of concurrency
+class Stats(object):
+
+    def __init__(self):
+        self.latencies = {}  # Callback output ('id.property') -> seconds
+        self.errors = {}  # Callback output -> number of failed requests
+        self.sessions = 0
+        self._lock = threading.Lock()
+
+    def add(self, name, seconds, error=False):
+        with self._lock:
+            self.latencies.setdefault(name, []).append(seconds)
+            if error:
+                self.errors[name] = self.errors.get(name, 0) + 1
+
+    def add_session(self):
+        with self._lock:
+            self.sessions += 1
+
+    def report(self, concurrency, elapsed):
+        requests = sum(len(latencies) for latencies in self.latencies.values())
+        errors = sum(self.errors.values())
+        callbacks = OrderedDict()
+        for name in sorted(self.latencies):
+            ms = np.array(self.latencies[name]) * 1000
+            callbacks[name] = OrderedDict([('requests', len(ms)),
+                                           ('errors', self.errors.get(name, 0)),
+                                           ('p50_ms', np.percentile(ms, 50)),
+                                           ('p95_ms', np.percentile(ms, 95)),
+                                           ('p99_ms', np.percentile(ms, 99))])
+        return OrderedDict([('concurrency', concurrency),
+                            ('seconds', elapsed),
+                            ('sessions', self.sessions),
+                            ('requests', requests),
+                            ('requests_per_second', requests / elapsed),
+                            ('error_rate', errors / requests if requests else 0.),
+                            ('callbacks', callbacks)])
+
+
+# One simulated dashboard page, with its own connection to the server
+class Session(object):
+
+    max_waves = 20  # Bound on the chain of callbacks triggered by one interaction
+
+    def __init__(self, url, stats, timeout=300):
+        parsed = urlparse(url)
+        self.host, self.port = parsed.hostname, parsed.port or 80
+        self.prefix = parsed.path.rstrip('/') + '/'
+        self.stats = stats
+        self.timeout = timeout
+        self.conn = None
+        self.values = {}  # (id, property) -> value
+        self.callbacks = []  # {'output': (id, property), 'inputs': [...], 'state': [...]}
+
+    def _request(self, method, path, body=None):
+        if self.conn is None:
+            self.conn = HTTPConnection(self.host, self.port, timeout=self.timeout)
+        try:
+            headers = {'Content-Type': 'application/json'} if body is not None else {}
+            self.conn.request(method, self.prefix + path, body, headers)
+            response = self.conn.getresponse()
+            return response.status, response.read()
+        except Exception:
+            self.conn.close()
+            self.conn = None
+            raise
+
+    # Load the page: the layout, the callback graph, and every callback
+    def load(self):
+        status, body = self._request('GET', '_dash-layout')
+        self._read_layout(json.loads(body.decode('utf-8')))
+        status, body = self._request('GET', '_dash-dependencies')
+        for dependency in json.loads(body.decode('utf-8')):
+            self.callbacks.append({'output': (dependency['output']['id'], dependency['output']['property']),
+                                   'inputs': [(c['id'], c['property']) for c in dependency['inputs']],
+                                   'state': [(c['id'], c['property']) for c in dependency['state']]})
+        self._fire(list(self.callbacks))
+
+    def _read_layout(self, component):
+        if isinstance(component, list):
+            for child in component:
+                self._read_layout(child)
+        elif isinstance(component, dict) and 'props' in component:
+            props = component['props']
+            for name, value in props.items():
+                if 'id' in props:
+                    self.values[props['id'], name] = value
+            self._read_layout(props.get('children'))
+
+    # Change the given (id, property) values, as the user would, and fire the callbacks that depend on them
+    def set(self, changes):
+        self.values.update(changes)
+        self._fire([c for c in self.callbacks if any(i in changes for i in c['inputs'])])
+
+    # Fire the pending callbacks in waves: a callback waits while another pending callback changes one of its inputs
+    def _fire(self, pending):
+        for _ in range(self.max_waves):
+            if not pending:
+                return
+            outputs = set(c['output'] for c in pending)
+            ready = [c for c in pending if not any(i in outputs and i != c['output'] for i in c['inputs'])] or pending
+            pending = [c for c in pending if c not in ready]
+            for callback in ready:
+                changed, value = self._call(callback)
+                if changed and value != self.values.get(callback['output']):
+                    self.values[callback['output']] = value
+                    pending.extend(c for c in self.callbacks if callback['output'] in c['inputs'] and c not in pending)
+
+    # Request a callback, returning (True, new value) or (False, None) if it did not update its output
+    def _call(self, callback):
+        output_id, output_property = callback['output']
+        body = json.dumps({'output': {'id': output_id, 'property': output_property},
+                           'inputs': [{'id': i, 'property': p, 'value': self.values.get((i, p))}
+                                      for i, p in callback['inputs']],
+                           'state': [{'id': i, 'property': p, 'value': self.values.get((i, p))}
+                                     for i, p in callback['state']]})
+        name = '{}.{}'.format(output_id, output_property)
+        start = timeit.default_timer()
+        try:
+            status, data = self._request('POST', '_dash-update-component', body)
+        except Exception:
+            self.stats.add(name, timeit.default_timer() - start, error=True)
+            return False, None
+        self.stats.add(name, timeit.default_timer() - start, error=status not in (200, 204))
+        if status != 200:
+            return False, None  # 204: the callback prevented the update
+        return True, json.loads(data.decode('utf-8'))['response']['props'][output_property]
+
+    def close(self):
+        if self.conn is not None:
+            self.conn.close()
+
+
+# Random value from the options of a dropdown (other than the given ones), or None if there are none
+def _pick(session, option_id, rng, exclude=()):
+    values = [o['value'] for o in session.values.get((option_id, 'options')) or [] if o['value'] not in exclude]
+    return rng.choice(values) if values else None
+
+
+# The scripted session: (description, function returning the changes of the step) pairs
+def session_steps(session, rng):
+    return [
+        ('division', lambda: {('division', 'value'): _pick(session, 'division', rng, ['Global'])}),
+        ('region', lambda: {('region', 'value'): _pick(session, 'region', rng)}),
+        ('area', lambda: {('area', 'value'): _pick(session, 'area', rng)}),
+        ('branch', lambda: {('branch', 'value'): _pick(session, 'branch', rng)}),
+        ('forecast', lambda: {('forecast_options', 'values'): ['linear_pred', 'arima_pred']}),
+        ('forecast poll', lambda: {('forecast_poll', 'n_intervals'):
+                                   (session.values.get(('forecast_poll', 'n_intervals')) or 0) + 1}),
+        ('compare', lambda: {('drab_tabs', 'value'): 2}),
+        ('division2', lambda: {('division2', 'value'): _pick(session, 'division2', rng, ['Global'])}),
+        ('secondary variable', lambda: {('sec_variable', 'value'):
+                                        _pick(session, 'variable', rng, [session.values.get(('variable', 'value'))])}),
+    ]
+
+
+# Run sessions as one user until deadline
+def _user(url, stats, deadline, think, seed):
+    rng = random.Random(seed)
+    while time.time() < deadline:
+        session = Session(url, stats)
+        try:
+            session.load()
+            for _, changes in session_steps(session, rng):
+                if time.time() >= deadline:
+                    return
+                time.sleep(rng.uniform(0, think))
+                session.set(changes())
+            stats.add_session()
+        except Exception as e:  # E.g. the layout could not be loaded; counted as errors, try again
+            stats.add('session', 0, error=True)
+            print('Session failed: {!r}'.format(e))
+            time.sleep(1)
+        finally:
+            session.close()
+
+
+# Run concurrency users for duration seconds, and return the report
+def run_level(url, concurrency, duration, think, seed=0):
+    stats = Stats()
+    start = time.time()
+    threads = [threading.Thread(target=_user, args=(url, stats, start + duration, think, seed + i))
+               for i in range(concurrency)]
+    for thread in threads:
+        thread.daemon = True
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return stats.report(concurrency, time.time() - start)
+
+
+def print_report(level):
+    print('{} users: {:.1f} requests/s, {} sessions, {:.2%} errors'.format(
+        level['concurrency'], level['requests_per_second'], level['sessions'], level['error_rate']))
+    for name, callback in level['callbacks'].items():
+        print('    {:<32} {:>6} requests  p50 {:>8.1f} ms  p95 {:>8.1f} ms  p99 {:>8.1f} ms  {} errors'.format(
+            name, callback['requests'], callback['p50_ms'], callback['p95_ms'], callback['p99_ms'], callback['errors']))
+    sys.stdout.flush()
+
+
+# Start serve.py on the synthetic data of scale (see benchmark.py), listening on the host and port of url
+def start_server(url, scale, data_dir):
+    import benchmark
+    parsed = urlparse(url)
+    env = dict(os.environ, MF_DASH_DATA_DIR=benchmark.scale_data(data_dir, scale),
+               MF_DASH_BIND='{}:{}'.format(parsed.hostname, parsed.port or 80))
+    server = subprocess.Popen([sys.executable, os.path.join(os.path.dirname(os.path.abspath(__file__)), 'serve.py')],
+                              env=env)
+    deadline = time.time() + 600
+    while time.time() < deadline and server.poll() is None:
+        try:
+            conn = HTTPConnection(parsed.hostname, parsed.port or 80, timeout=5)
+            conn.request('GET', parsed.path.rstrip('/') + '/health')
+            if conn.getresponse().status == 200:
+                return server
+        except Exception:
+            pass
+        time.sleep(1)
+    server.terminate()
+    raise RuntimeError('The server did not start')
+
+
+def main(argv=None):
+    import benchmark
+    parser = argparse.ArgumentParser(description='Load test the dashboard callbacks with simulated users.')
+    parser.add_argument('--url', default='http://127.0.0.1:8050', help='address of the dashboard')
+    parser.add_argument('--concurrency', type=int, nargs='+', default=[1, 2, 4, 8, 16],
+                        help='numbers of concurrent users to test, in turn (default: 1 2 4 8 16)')
+    parser.add_argument('--duration', type=float, default=60, help='seconds per level of concurrency (default 60)')
+    parser.add_argument('--think', type=float, default=1,
+                        help='maximum seconds a user waits between interactions (default 1)')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--serve', choices=list(benchmark.scales),
+                        help='start serve.py on synthetic data of this scale (see benchmark.py) for the test')
+    parser.add_argument('--data-dir', default=os.path.join(tempfile.gettempdir(), 'mf_dash_benchmark'),
+                        help='directory of the synthetic data')
+    parser.add_argument('--output', help='file to write the results to as JSON')
+    args = parser.parse_args(argv)
+
+    server = start_server(args.url, args.serve, args.data_dir) if args.serve else None
+    try:
+        levels = []
+        for concurrency in args.concurrency:
+            levels.append(run_level(args.url, concurrency, args.duration, args.think, args.seed))
+            print_report(levels[-1])
+    finally:
+        if server is not None:
+            server.terminate()
+            server.wait()
+
+    if args.output:
+        report = OrderedDict([('created', time.strftime('%Y-%m-%dT%H:%M:%S')),
+                              ('url', args.url),
+                              ('scale', args.serve),
+                              ('duration', args.duration),
+                              ('think', args.think),
+                              ('levels', levels)])
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+        print('Results written to {}'.format(args.output))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
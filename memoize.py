@@ -0,0 +1,126 @@
+# Memoization of callbacks that are pure functions of their inputs and the loaded data (e.g. update_at_a_glance), so
+# that a view that has been rendered before (e.g. the same division opened by many users) is served without recomputing
+# it. Other functions of the callbacks (e.g. series_figure, the traces of the time-series graph) can be memoized too.
+#
+#     @app.callback(Output(...), [Input(...), ...])
+#     @memoize()
+#     def update_something(...):
+#
+# Results are keyed on the function, its arguments and the data version, and expire after ttl seconds. They are kept in
+# one of these backends, chosen with the MF_DASH_MEMOIZE_BACKEND environment variable:
+# - 'memory' (default): a bounded in-process LRU cache per function.
+# - 'disk': a bounded directory of files per function (see cache.DiskCache), shared by all server processes on the
+#   host. Results are stored as JSON (in the form dash sends them to the browser), so plotly/dash objects come back
+#   as plain dicts.
+# - 'off': no memoization.
+# A function can call dont_cache() to keep the result of the current call out of the cache (e.g. because it is
+# incomplete). Hit and miss counts of every memoized function are available from stats().
+import functools
+import hashlib
+import json
+import os
+import threading
+import time
+
+import dataset
+from cache import LRUCache, DiskCache
+
+memoize_backend = os.environ.get('MF_DASH_MEMOIZE_BACKEND', 'memory')
+memoize_ttl = float(os.environ.get('MF_DASH_MEMOIZE_TTL', 3600))  # Seconds, 0 for no expiry
+memoize_size = int(os.environ.get('MF_DASH_MEMOIZE_SIZE', 256))  # Results kept per function
+memoize_dir = os.environ.get('MF_DASH_MEMOIZE_DIR', os.path.join(dataset.cache_dir, 'memoize'))
+
+memos = {}  # Function name -> Memo
+_state = threading.local()
+
+
+# Keep the result of the memoized call that is currently running out of the cache
+def dont_cache():
+    _state.cacheable = False
+
+
+# The cached results of one function: entries are (time stored, value) pairs in cache (an LRUCache or DiskCache)
+class Memo(object):
+
+    def __init__(self, name, cache, ttl=None, encode=None, decode=None):
+        self.name = name
+        self.cache = cache
+        self.ttl = ttl
+        self.encode = encode
+        self.decode = decode
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+    def key(self, args, kwargs):
+        return hashlib.sha1(repr((self.name, args, sorted(kwargs.items()), dataset.state.version))
+                            .encode('utf-8')).hexdigest()
+
+    # Return (True, value) if a result that has not expired is stored under key, (False, None) otherwise
+    def get(self, key):
+        entry = self.cache.get(key)
+        found = entry is not None and not (self.ttl and time.time() - entry[0] > self.ttl)
+        with self._lock:
+            if found:
+                self.hits += 1
+            else:
+                self.misses += 1
+        if not found:
+            return False, None
+        return True, entry[1] if self.decode is None else self.decode(entry[1])
+
+    def set(self, key, value):
+        self.cache.set(key, (time.time(), value if self.encode is None else self.encode(value)))
+
+
+def _plotly_json(value):
+    from plotly.utils import PlotlyJSONEncoder
+    return json.dumps(value, cls=PlotlyJSONEncoder)
+
+
+# Decorator memoizing a function in the given backend (see above), keeping at most maxsize results for ttl seconds
+def memoize(ttl=memoize_ttl, maxsize=memoize_size, backend=memoize_backend):
+    def decorator(func):
+        name = '{}.{}'.format(func.__module__, func.__name__)
+        if backend == 'off':
+            return func
+        elif backend == 'memory':
+            memo = Memo(name, LRUCache(maxsize=maxsize), ttl)
+        elif backend == 'disk':
+            memo = Memo(name, DiskCache(os.path.join(memoize_dir, name), maxsize=maxsize), ttl,
+                        encode=_plotly_json, decode=json.loads)
+        else:
+            raise ValueError('Unknown memoize backend {!r} (MF_DASH_MEMOIZE_BACKEND), expected memory, disk or off'
+                             .format(backend))
+        memos[name] = memo
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            key = memo.key(args, kwargs)
+            found, value = memo.get(key)
+            if found:
+                return value
+            outer = getattr(_state, 'cacheable', True)
+            _state.cacheable = True
+            try:
+                value = func(*args, **kwargs)
+            except Exception:
+                _state.cacheable = outer
+                raise
+            cacheable = _state.cacheable
+            _state.cacheable = outer and cacheable  # Results built from an incomplete result are incomplete too
+            if cacheable:
+                try:
+                    memo.set(key, value)
+                except (IOError, OSError):
+                    pass  # Not cached, e.g. because the disk is full
+            return value
+
+        wrapper.memo = memo
+        return wrapper
+    return decorator
+
+
+# Hit and miss counts of every memoized function, e.g. {'at_a_glance.update_at_a_glance': {'hits': 3, 'misses': 1}}
+def stats():
+    return dict((name, {'hits': memo.hits, 'misses': memo.misses}) for name, memo in memos.items())
@@ -0,0 +1,160 @@
+# Batch precomputation of ARIMA forecasts, to be run nightly (e.g. from cron) after the data has been updated:
+#
+#     python precompute_forecasts.py --processes 8
+#
+# Fits the forecast of every DRAB node and important variable for every standard look-back/look-ahead option of the
+# dashboard, in parallel across a process pool, and stores the results in the on-disk forecast store (see
+# forecast_cache.py). The dashboard then serves these forecasts without fitting anything.
+# Every look-back window is fitted once, for the longest look-ahead, and the forecasts for the shorter look-aheads are
+# the first months of that one. Look-back options that give the same window (e.g. 24 months and 'all' with the default
+# timeframe) are fitted once as well.
+# Forecasts that are already in the store are skipped, so an interrupted run can simply be started again.
+#
+# With --batch, the forecasts of all nodes for the same variable and options are fitted at once with the backend's
+# forecast_batch (e.g. with MF_DASH_FORECAST_BACKEND=hw, which fits a whole matrix of series with array operations).
+from __future__ import division
+
+import argparse
+import itertools
+import multiprocessing
+import sys
+import time
+
+from collections import OrderedDict
+
+import numpy as np
+
+import dataset
+import forecast_cache
+import forecasting
+from drab_tree import drab_levels
+from forecasting import arima_forecast, forecast_key
+from trend_index import trend_window
+from variables import important_vars
+
+# The look-back and look-ahead options of the forecast dropdowns in layout.py
+look_back_options = [6, 12, 24, 'all']
+look_ahead_options = [3, 6, 9, 12]
+
+
+# Every (keys, y, look_ahead) job for the given nodes, variables and timeframe, in node order: one per look-back window,
+# with keys the (look-ahead, key) pairs of the forecasts of the window (only those not in skip, if given) and look_ahead
+# the longest of them
+def forecast_jobs(nodes, variables, timeframe, skip=()):
+    for node, variable in itertools.product(nodes, variables):
+        y = dataset.state.store.node_aggregate(variable, node, 'mean')
+        windows = OrderedDict()  # (start, stop) -> [(look-ahead, key)]
+        for look_back, look_ahead in itertools.product(look_back_options, look_ahead_options):
+            key = forecast_key('arima', node, variable, timeframe, look_back, look_ahead)
+            keys = windows.setdefault((key[3], key[4]), [])
+            if key not in skip and key not in [k for _, k in keys]:
+                keys.append((look_ahead, key))
+        for (start, stop), keys in windows.items():
+            if keys:
+                yield keys, y[start:stop], max(look_ahead for look_ahead, _ in keys)
+
+
+# The (key, result) pairs of a forecast for the longest look-ahead of a job: the first months of it for each of its keys
+def _split(keys, result):
+    return [(key, tuple(a[:look_ahead] for a in result)) for look_ahead, key in keys]
+
+
+# Run in the pool processes: fit the forecast of a job, returning (keys, result, error)
+def _fit(job):
+    keys, y, look_ahead = job
+    try:
+        return keys, arima_forecast(y, look_ahead), None
+    except Exception as e:
+        return keys, None, repr(e)
+
+
+# Fit the jobs in groups sharing the same variable, months and look-ahead with the backend's forecast_batch, yielding
+# (keys, result, error) like _fit
+def _fit_batches(jobs):
+    groups = OrderedDict()
+    for job in jobs:
+        keys, y, look_ahead = job
+        key = keys[0][1]
+        groups.setdefault((key[2], key[3], key[4], look_ahead), []).append(job)
+    for group in groups.values():
+        look_ahead = group[0][2]
+        mean, upper_80, lower_80 = forecasting.backend.forecast_batch(np.array([job[1] for job in group]), look_ahead)
+        for i, job in enumerate(group):
+            if np.isnan(mean[i, 0]):
+                yield job[0], None, 'no forecast'
+            else:
+                yield job[0], (mean[i], upper_80[i], lower_80[i]), None
+
+
+def main(argv=None):
+    n_months = len(dataset.state.store.months)
+    parser = argparse.ArgumentParser(description='Precompute the ARIMA forecasts shown by the dashboard.')
+    parser.add_argument('--processes', type=int, default=multiprocessing.cpu_count(),
+                        help='number of forecasts fitted in parallel (default: number of CPUs)')
+    parser.add_argument('--start', type=int, default=max(n_months - 24, 0),
+                        help='first month of the timeframe (default: the dashboard default, the last 24 months)')
+    parser.add_argument('--variables', nargs='+', default=important_vars,
+                        help='variables to forecast (default: the important variables)')
+    parser.add_argument('--levels', nargs='+', default=['Global'] + drab_levels, choices=['Global'] + drab_levels,
+                        help='DRAB levels to forecast (default: all)')
+    parser.add_argument('--batch', action='store_true',
+                        help='fit the forecasts of all nodes at once with the backend\'s batch forecaster')
+    parser.add_argument('--report-every', type=float, default=30, help='seconds between progress reports')
+    args = parser.parse_args(argv)
+
+    if forecast_cache.disk_cache is None:
+        print('The on-disk forecast store is disabled (MF_DASH_FORECAST_DIR), nothing to precompute')
+        return 1
+    missing = [v for v in args.variables if v not in dataset.state.store.blocks]
+    if missing:
+        print('Unknown variables: {}'.format(', '.join(missing)))
+        return 1
+
+    timeframe = (args.start, n_months)
+    nodes = [node for level in args.levels for node in dataset.state.tree.level_nodes[level]]
+    windows = set(trend_window(look_back, timeframe[1], timeframe[0]) for look_back in look_back_options)
+    total = len(nodes) * len(args.variables) * len(windows) * len(look_ahead_options)
+    jobs = list(forecast_jobs(nodes, args.variables, timeframe, skip=forecast_cache.disk_cache))
+    missing = sum(len(keys) for keys, _, _ in jobs)
+    print('{} forecasts for {} nodes x {} variables, {} already stored, fitting {} in {} fits with the {} backend{}'
+          .format(total, len(nodes), len(args.variables), total - missing, missing, len(jobs),
+                  forecasting.backend.name, ' in batches' if args.batch else ' in {} processes'.format(args.processes)))
+    if forecast_cache.disk_cache.maxsize is not None and total > forecast_cache.disk_cache.maxsize:
+        print('Warning: the forecast store only keeps {} forecasts, '
+              'set MF_DASH_FORECAST_DIR_SIZE to keep them all'.format(forecast_cache.disk_cache.maxsize))
+
+    done, failed = 0, 0
+    start = last_report = time.time()
+    pool = None if args.batch else multiprocessing.Pool(args.processes)
+    results = _fit_batches(jobs) if args.batch else pool.imap_unordered(_fit, jobs, chunksize=4)
+    try:
+        for keys, result, error in results:
+            done += 1
+            if error is None:
+                for key, forecast in _split(keys, result):
+                    forecast_cache.disk_cache.set(key, forecast)
+            else:
+                failed += 1
+                print('Forecast {} failed: {}'.format(keys[-1][1], error))
+            now = time.time()
+            if now - last_report >= args.report_every or done == len(jobs):
+                last_report = now
+                elapsed = now - start
+                print('{}/{} fits done ({} failed) in {:.0f}s, {:.0f}s remaining'.format(
+                    done, len(jobs), failed, elapsed, elapsed / done * (len(jobs) - done)))
+                sys.stdout.flush()
+        if pool is not None:
+            pool.close()
+    except KeyboardInterrupt:
+        if pool is not None:
+            pool.terminate()
+        print('Interrupted after {} of {} forecasts, run again to continue'.format(done, len(jobs)))
+        return 1
+    finally:
+        if pool is not None:
+            pool.join()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,86 @@
+# Ranking index: the rank and percentile of every DRAB node among its peers (all nodes at the same level), for every
+# variable/KPI and month. Ranks are computed on first use, for a whole level at once with a vectorized argsort over the
+# aggregated (nodes x months) arrays, and kept for the lifetime of the store they were computed from (every version of
+# the data comes with a new store, and therefore a new index).
+from __future__ import division
+
+import re
+
+import numpy as np
+
+from drab_tree import drab_levels
+from kpi import kpi_branch_series
+
+# Whether a lower value is better, for each KPI in kpi.kpi_names
+kpi_lower_is_better = [False, False, True, True]
+
+
+# Variables measuring overdue amounts/ratios are better when lower
+def lower_is_better(variable):
+    return re.search(r'\bOD\b', variable) is not None
+
+
+# Rank (1 = best) and percentile (100 = best) of every row of values among all rows, for every other index. Tied
+# values share the best of their ranks (competition ranking, e.g. 1, 2, 2, 4). NaN values are not ranked (their rank
+# and percentile are NaN) and do not count as peers.
+def rank(values, lower_is_better=False):
+    key = (values if lower_is_better else -values).reshape(len(values), -1)
+    columns = np.arange(key.shape[1])
+    order = np.argsort(key, axis=0, kind='mergesort')  # NaNs last
+    ordered = key[order, columns]
+    # Every value takes the position of the first value equal to it in the sort order
+    tied = np.zeros(key.shape, dtype=bool)
+    tied[1:] = ordered[1:] == ordered[:-1]
+    first = np.maximum.accumulate(np.where(tied, 0, np.arange(len(key))[:, None]), axis=0)
+    ranks = np.empty(key.shape, dtype=np.float32)
+    ranks[order, columns] = first + 1
+    ranks = ranks.reshape(values.shape)
+    missing = np.isnan(values)
+    ranks[missing] = np.nan
+    peers = (~missing).sum(axis=0)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        percentile = np.where(peers > 1, 100 * (peers - ranks) / (peers - 1), 100.).astype(np.float32)
+    percentile[missing] = np.nan
+    return ranks, percentile
+
+
+class RankingIndex(object):
+
+    def __init__(self, store):
+        self.store = store
+        self._ranks = {}
+
+    # Ranks and percentiles of the per-branch mean of variable, for every node at level: two (nodes x months) arrays,
+    # rows in tree.level_nodes[level] order
+    def variable_ranks(self, variable, level):
+        key = (variable, level)
+        if key not in self._ranks:
+            values = self.store.level_aggregate(variable, level)['mean']
+            self._ranks[key] = rank(values, lower_is_better(variable))
+        return self._ranks[key]
+
+    # Ranks and percentiles of the at-a-glance KPIs, for every node at level: two (nodes x KPIs x months) arrays. Like
+    # the variables, the KPIs are ranked per branch (see kpi.kpi_branch_series), so that e.g. a division ranks first on
+    # Current Borrowers for having the most borrowers per branch, not for having the most branches.
+    def kpi_ranks(self, level):
+        key = ('KPIs', level)
+        if key not in self._ranks:
+            series = kpi_branch_series(self.store, self.store.tree.level_nodes[level])
+            ranks, percentile = [np.empty(series.shape, dtype=np.float32) for _ in range(2)]
+            for k, lower in enumerate(kpi_lower_is_better):
+                ranks[:, k], percentile[:, k] = rank(series[:, k], lower)
+            self._ranks[key] = ranks, percentile
+        return self._ranks[key]
+
+    # Rank of node for every KPI at the given month (default: the latest), and the number of its ranked peers
+    def node_kpi_ranks(self, node, month=-1):
+        ranks = self.kpi_ranks(self.store.tree.level[node])[0][:, :, month]
+        return ranks[self.store.tree.level_index[node]], (~np.isnan(ranks)).sum(axis=0)
+
+    # Compute the ranks of every variable and of the KPIs at every level
+    def build(self, variables=True):
+        for level in drab_levels:
+            self.kpi_ranks(level)
+            if variables:
+                for variable in self.store.variables:
+                    self.variable_ranks(variable, level)
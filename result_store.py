@@ -0,0 +1,38 @@
+# Server-side store of computed results (e.g. the points of the scatter plot), so that callbacks can pass a small key
+# through a hidden div instead of the results themselves, and dependent callbacks fetch the results by key. Keys are
+# strings that should identify everything the result depends on, including the data version.
+# Results are kept in a bounded in-memory LRU cache and, so that they can be shared by several server processes, in an
+# on-disk store.
+import os
+
+import dataset
+from cache import LRUCache, DiskCache, TieredCache
+
+# Number of results kept in memory. Can be set with the MF_DASH_RESULT_CACHE_SIZE environment variable.
+memory_cache = LRUCache(maxsize=int(os.environ.get('MF_DASH_RESULT_CACHE_SIZE', 64)))
+
+# Directory of the on-disk result store. Can be set with the MF_DASH_RESULT_DIR environment variable; set it to an
+# empty string to keep results in memory only (which is fine with a single server process).
+result_dir = os.environ.get('MF_DASH_RESULT_DIR', os.path.join(dataset.cache_dir, 'results'))
+disk_cache = None
+if result_dir:
+    try:
+        disk_cache = DiskCache(result_dir, maxsize=int(os.environ.get('MF_DASH_RESULT_DIR_SIZE', 1000)))
+    except (IOError, OSError) as e:
+        print('Results will not be stored on disk, could not create {}: {}'.format(result_dir, e))
+
+_cache = TieredCache(memory_cache, disk_cache)
+
+
+# Return the result stored under key, or None if there is none (e.g. if it has been evicted)
+def get(key):
+    return _cache.get(key)
+
+
+def put(key, result):
+    _cache.set(key, result)
+
+
+# Hit and miss counts of the cache, e.g. {'hits': 3, 'misses': 1}
+def stats():
+    return {'hits': _cache.hits, 'misses': _cache.misses}
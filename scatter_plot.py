@@ -4,9 +4,22 @@ import plotly.graph_objs as go
 import numpy as np
 from scipy import stats
 import json
+import os
 
 from layout import *
 from filter_df import *
+import dataset
+import result_store
+from memoize import memoize
+from instrument import stage
+
+# Selections with more points than this are shown as a 2D histogram (density mode) instead of raw points, so that the
+# browser is not sent every (branch, month) pair. Points in sparsely populated bins (at most scatter_sparse_count
+# points) are drawn on top as outliers, sampled down to at most scatter_max_outliers points.
+scatter_max_points = int(os.environ.get('MF_DASH_SCATTER_MAX_POINTS', 20000))
+scatter_bins = int(os.environ.get('MF_DASH_SCATTER_BINS', 100))
+scatter_sparse_count = 2
+scatter_max_outliers = 2000
 
 
 @app.callback(Output('scatter_graph_div','style'),
@@ -18,6 +31,87 @@ def update_scatter_div(sec_variable):
         return {'width': '100%', 'display': 'inline-block'}
 
 
+# Paired (x, y) values of variable and sec_variable for every branch and month under the DRAB node in store, as two 1-d
+# arrays. Rows of the array store are aligned by branch, so the two (branches x months) blocks can be paired up
+# directly; all filtering is done with boolean masks over the whole blocks.
+def scatter_points(store, variable, sec_variable, node, quant_trim=False):
+    x = store.rows(variable, node)
+    y = store.rows(sec_variable, node)
+
+    # We should make it clear that zero-entries correspond to missing values (this is generally the case...), and we
+    # remove any (x,y) pairs containing at least one missing value
+    mask = (x != 0) & (y != 0) & ~np.isnan(x) & ~np.isnan(y)
+    x, y = x[mask].astype(np.float64), y[mask].astype(np.float64)
+
+    # Should we also remove outliers/extreme values? -> This would make the figure more informative/discernable.
+    # -> Remove any (x,y) pairs where either x or y lies in the 99.5% percentile of their respective distributions.
+    # -> TODO: Look into better ways of deciding whether values are outliers or not... e.g. Cook's distance?
+    if quant_trim and len(x):
+        mask = (x < np.percentile(x, 99.5)) & (y < np.percentile(y, 99.5))
+        x, y = x[mask], y[mask]
+
+    return x, y
+
+
+# Density mode traces: a heatmap of the number of points in each of bins x bins cells (empty cells are left blank),
+# and a sample of the points in sparse cells
+def density_traces(x, y, bins):
+    counts, x_edges, y_edges = np.histogram2d(x, y, bins=bins)
+    z = counts.T.astype(object)
+    z[counts.T == 0] = None
+    traces = [go.Heatmap(x=((x_edges[:-1] + x_edges[1:]) / 2).tolist(),
+                         y=((y_edges[:-1] + y_edges[1:]) / 2).tolist(),
+                         z=z.tolist(),
+                         colorscale='Viridis',
+                         colorbar=dict(title='Points'),
+                         hoverinfo='x+y+z')]
+
+    # Cell of every point (the last edge is included in the last cell, as in histogram2d)
+    i = np.clip(np.searchsorted(x_edges, x, side='right') - 1, 0, bins - 1)
+    j = np.clip(np.searchsorted(y_edges, y, side='right') - 1, 0, bins - 1)
+    sparse = np.flatnonzero(counts[i, j] <= scatter_sparse_count)
+    if len(sparse) > scatter_max_outliers:
+        sparse = np.sort(np.random.RandomState(0).choice(sparse, scatter_max_outliers, replace=False))
+    if len(sparse):
+        traces.append(go.Scattergl(x=x[sparse].tolist(), y=y[sparse].tolist(), mode='markers',
+                                   marker=dict(size=5, opacity=.5), name='Outliers'))
+    return traces
+
+
+# Key of the scatter result of a selection. It is small enough to be passed through the hidden scatter_calc div, and
+# holds everything needed to compute the result again if it is no longer in the result store.
+def scatter_key(state, variable, sec_variable, node, scatter_options):
+    return json.dumps(['scatter', variable, sec_variable, node, sorted(scatter_options), state.version])
+
+
+# The scatter points (and regression) of the selection with the given key, from the result store if they are there
+# (or None if the key is from another version of the data)
+def scatter_result(key):
+    result = result_store.get(key)
+    if result is None:
+        state = dataset.state
+        _, variable, sec_variable, node, scatter_options, version = json.loads(key)
+        if version != state.version:
+            return None
+
+        with stage('aggregation'):
+            # Extract all data corresponding to 'variable' and 'sec_variable' for the branches under the selected DRAB.
+            x, y = scatter_points(state.store, variable, sec_variable, node, 'quant_trim' in scatter_options)
+            result = {'variable': variable, 'sec_variable': sec_variable, 'x': x, 'y': y}
+
+            # The regression is always fitted on all points, also in density mode. It needs at least two distinct x
+            # values, so a selection with fewer (e.g. a single branch after trimming) gets no fit line.
+            if 'rsquare' in scatter_options and len(x) > 1 and x.min() < x.max():
+                gradient, intercept, r_value, p_value, std_err = stats.linregress(x, y)
+                result['reg_coeffs'] = {'gradient': gradient, 'intercept': intercept, 'r_value': r_value,
+                                        'p_value': p_value, 'std_err': std_err}
+
+        result_store.put(key, result)
+    return result
+
+
+# Computes the scatter points (and regression) of the selection and keeps them in the server-side result store. The
+# hidden scatter_calc div only receives the key of the result, which the callbacks below use to fetch it.
 @app.callback(
     Output(component_id='scatter_calc', component_property='children'),
     [Input('variable', 'value'),
@@ -27,97 +121,15 @@ def update_scatter_div(sec_variable):
      Input('area', 'value'),
      Input('branch', 'value'),
      Input('scatter_options', 'values')])
+@memoize()
 def update_scatter_calc(variable, sec_variable, division, region, area, branch, scatter_options):
     # Ensure that we have the value of sec_variable is not None
     if sec_variable:
-        # Extract all data corresponding to 'variable' and 'sec_variable'
-
-        df = df_main[df_main['variable'].isin([variable, sec_variable])]
-        df = pd.merge(branchlist, df, on='branch_code')
-
-        # We should make it clear that zero-entries correspond to mising values (this is generally the case...)
-        df = df.replace({0: np.nan})
-
-        # Now, filter out those branches that are not relevant to whatever DRAB is specified.
-        if division=='Global':
-            pass
-        elif not region or not pd.Series(region).isin(
-            branchlist[branchlist['Division'].isin([division])]['Region']).bool():
-            df = df[df['Division'].isin([division])]
-        elif not area or not pd.Series(area).isin(branchlist[branchlist['Region'].isin([region])]['Area']).bool():
-            df = df[df['Division'].isin([division])]
-            df = df[df['Region'].isin([region])]
-        elif not branch or not pd.Series(branch).isin(branchlist[branchlist['Area'].isin([area])]['Branch']).bool():
-            df = df[df['Division'].isin([division])]
-            df = df[df['Region'].isin([region])]
-            df = df[df['Area'].isin([area])]
-        elif branch:
-            df = df[df['Division'].isin([division])]
-            df = df[df['Region'].isin([region])]
-            df = df[df['Area'].isin([area])]
-            df = df[df['Branch'].isin([branch])]
-
-        x = df[df['variable'].isin([variable])]
-        y = df[df['variable'].isin([sec_variable])]
-
-        x = x.sort_values(by=['branch_code'])
-        y = y.sort_values(by=['branch_code'])
-
-        print x
-
-        x = x[x.columns[7:]].values.tolist()
-        y = y[y.columns[7:]].values.tolist()
-
-        # Flatten the lists
-        x = [item for sublist in x for item in sublist]
-        y = [item for sublist in y for item in sublist]
-
-        # We remove any (x,y) pairs containing at least one nan value
-        x_copy = x
-        x = [x[i] for i in range(len(x)) if (not np.isnan(x[i])) and (not np.isnan(y[i]))]
-        y = [y[i] for i in range(len(y)) if (not np.isnan(x_copy[i])) and (not np.isnan(y[i]))]
-
-        # Should we also remove outliers/extreme values? -> This would make the figure more informative/discernable.
-        # -> Remove any (x,y) pairs where either x or y lies in the 99.5% percentile of their respective distributions.
-        # -> TODO: Look into better ways of deciding whether values are outliers or not... e.g. Cook's distance?
-
-        if 'quant_trim' in scatter_options:
-            x_np = np.array(x)
-            y_np = np.array(y)
-            # noinspection PyTypeChecker
-            x_99pc = np.percentile(x_np, 99.5)
-            # noinspection PyTypeChecker
-            y_99pc = np.percentile(y_np, 99.5)
-
-            x_copy = x
-            x = [x[i] for i in range(len(x)) if x[i] < x_99pc and y[i] < y_99pc]
-            y = [y[i] for i in range(len(y)) if x_copy[i] < x_99pc and y[i] < y_99pc]
-
-        traces = [go.Scattergl(x=x, y=y, mode='markers', marker=dict(size=5, opacity=.2))]
-
-        output = {}
-
-        if 'rsquare' in scatter_options:
-            gradient, intercept, r_value, p_value, std_err = stats.linregress(x, y)
-            print 'gradient = {}'.format(gradient)
-            x_min, x_max = [min(x), max(x)]
-            traces.append(go.Scattergl(
-                x=[x_min, x_max],
-                y=[intercept + x_min * gradient, intercept + x_max * gradient],
-                mode='lines',
-                name='Linear Regression'))
-            output['reg_coeffs'] = {'gradient': gradient, 'intercept': intercept, 'r_value': r_value,
-                                    'p_value': p_value, 'std_err': std_err}
-
-        output['data'] = traces
-        output['layout'] = go.Layout(
-            xaxis={'title': variable},
-            yaxis={'title': sec_variable},
-            margin={'l': 60, 'b': 60, 't': 20, 'r': 20},
-            hovermode='closest',
-            showlegend=False)
-
-        return json.dumps(output)  # HTML div can only store string objects, so convert dictionary to JSON format
+        state = dataset.state
+        key = scatter_key(state, variable, sec_variable, state.tree.resolve([division, region, area, branch]),
+                          scatter_options)
+        scatter_result(key)
+        return key
 
 
 # Callback to update scatter plot
@@ -127,10 +139,34 @@ def update_scatter_calc(variable, sec_variable, division, region, area, branch,
     Output(component_id='scatter_graph', component_property='figure'),
     [Input('scatter_calc', 'children')])
 def update_scatter_graph(scatter_calc):
-    if not scatter_calc:  # Avoids errors on server start-up
+    result = scatter_result(scatter_calc) if scatter_calc else None
+    if result is None:  # Avoids errors on server start-up
         return {}
-    scatter_calc = json.loads(scatter_calc) # Convert input from JSON back to dictionary
-    return {'data': scatter_calc['data'], 'layout': scatter_calc['layout']}
+    x, y = result['x'], result['y']
+
+    with stage('figure'):
+        # Large selections are binned, small ones (e.g. a single area) keep their raw points
+        if len(x) > scatter_max_points:
+            traces = density_traces(x, y, scatter_bins)
+        else:
+            traces = [go.Scattergl(x=x.tolist(), y=y.tolist(), mode='markers', marker=dict(size=5, opacity=.2))]
+
+        if 'reg_coeffs' in result:
+            rc = result['reg_coeffs']
+            x_min, x_max = x.min(), x.max()
+            traces.append(go.Scattergl(
+                x=[x_min, x_max],
+                y=[rc['intercept'] + x_min * rc['gradient'], rc['intercept'] + x_max * rc['gradient']],
+                mode='lines',
+                name='Linear Regression'))
+
+        return {'data': traces,
+                'layout': go.Layout(
+                    xaxis={'title': result['variable']},
+                    yaxis={'title': result['sec_variable']},
+                    margin={'l': 60, 'b': 60, 't': 20, 'r': 20},
+                    hovermode='closest',
+                    showlegend=False)}
 
 
 # Callback to update regression coefficients
@@ -141,11 +177,11 @@ def update_scatter_graph(scatter_calc):
     [Input('scatter_calc', 'children'),
      Input('scatter_options', 'values')])
 def update_reg_coeffs(scatter_calc, scatter_options):
-    if not scatter_calc:  # Avoids errors on server start-up
+    result = scatter_result(scatter_calc) if scatter_calc else None
+    if result is None:  # Avoids errors on server start-up
         return []
-    scatter_calc = json.loads(scatter_calc)
-    if 'rsquare' in scatter_options:
-        rc = scatter_calc['reg_coeffs']
+    if 'rsquare' in scatter_options and 'reg_coeffs' in result:
+        rc = result['reg_coeffs']
         return [html.Div('Correlation = {0:.2g}'.format(rc['r_value'])),
                 html.Div('Intercept = {0:.2g}'.format(rc['intercept'])),
                 html.Div('Gradient = {0:.2g} (p = {1:.2g})'.format(rc['gradient'], rc['p_value']))]
\ No newline at end of file
@@ -0,0 +1,61 @@
+# Production server. dash_main.py runs the single-process Flask development server; this runs the dashboard under
+# gunicorn with several worker processes, each answering several requests at once:
+#     python serve.py
+# or, with the same settings and any other gunicorn options,
+#     gunicorn -c serve.py dash_main:server
+#
+# The app is loaded once, in the gunicorn master process, before the workers are forked (preload_app). The data is
+# memory-mapped from the binary data cache (see data_cache.py), and the level aggregates and indexes are built before
+# the fork (pre_fork) and never written to, so all workers share one physical copy of them instead of each loading its
+# own. Callbacks are plain numpy reads, so threads within a worker mostly wait on I/O and the GIL is held only briefly.
+#
+# Settings (environment variables):
+# - MF_DASH_BIND: address to listen on (default 0.0.0.0:8050).
+# - MF_DASH_WORKERS: number of worker processes (default: number of CPUs).
+# - MF_DASH_THREADS: request threads per worker (default 4).
+# - MF_DASH_WORKER_TIMEOUT: seconds after which a worker that does not respond is restarted (default 120).
+# Every worker fits forecasts in its own pool of MF_DASH_FORECAST_PROCESSES processes (see timeseries_plot.py), so
+# keep workers x forecast processes at about the number of CPUs, or precompute the forecasts (precompute_forecasts.py).
+# Set MF_DASH_MEMOIZE_BACKEND=disk so that the workers share memoized views (see memoize.py).
+#
+# Every worker checks for new data itself (see ingest.py). The first one to find new months writes them to the data
+# cache, and the others map them from there, so that most workers keep sharing one copy of the data after an update.
+import multiprocessing
+import os
+
+bind = os.environ.get('MF_DASH_BIND', '0.0.0.0:8050')
+workers = int(os.environ.get('MF_DASH_WORKERS', multiprocessing.cpu_count()))
+threads = int(os.environ.get('MF_DASH_THREADS', 4))
+worker_class = 'gthread'
+timeout = int(os.environ.get('MF_DASH_WORKER_TIMEOUT', 120))
+preload_app = True
+
+
+# The level aggregates and KPI ranks are computed in the master process before the workers are forked, so that all
+# workers share them (a single process, e.g. dash_main.py, computes them on first use instead, to start faster)
+def pre_fork(server, worker):
+    import dataset
+    dataset.state.warm()
+
+
+# Threads do not survive the fork, so the check for new data is started in every worker
+def post_fork(server, worker):
+    import ingest
+    ingest.start()
+
+
+if __name__ == '__main__':
+    from gunicorn.app.base import BaseApplication
+
+    class Server(BaseApplication):
+
+        def load_config(self):
+            for name in ['bind', 'workers', 'threads', 'worker_class', 'timeout', 'preload_app', 'pre_fork',
+                         'post_fork']:
+                self.cfg.set(name, globals()[name])
+
+        def load(self):
+            from dash_main import server
+            return server
+
+    Server().run()
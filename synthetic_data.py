@@ -0,0 +1,114 @@
+# Synthetic branch data with the same schema as the real dabi_global.csv and branchlist.csv, for benchmarks and for
+# running the dashboard without access to the real data:
+#
+#     python synthetic_data.py /tmp/mf-data --divisions 8 --regions 5 --areas 6 --branches 8 --variables 40
+#     MF_DASH_DATA_DIR=/tmp/mf-data python dash_main.py
+#
+# --regions, --areas and --branches are counts per parent, so the example has 8 x 5 x 6 x 8 = 1920 branches.
+# The variables are the ones the dashboard refers to by name (KPIs and important variables) followed by generic ones.
+# Every (branch, variable) series is a branch-specific level with a trend, a yearly season and noise. Like the real
+# data, a fraction of the values is zero or missing, a few branches of the branchlist have no data at all and a few rows
+# belong to branch codes that are not in the branchlist.
+from __future__ import division
+
+import argparse
+import os
+import sys
+
+import numpy as np
+import pandas as pd
+
+# Variables the dashboard refers to by name (see kpi.py and variables.py)
+named_variables = ['Current OD Tk.', 'Total Current OS Tk.', 'Total OD [Excl.NL2] Tk.', 'Total OS [Excl.NL2] Tk.',
+                   'Current Borrowers', 'Amount Disbursed (Month) Tk.', 'Current OD/OS ratio (Monthly)',
+                   'General Savings (Month) Tk.']
+
+# Typical branch values of the named variables (overdue amounts are a small fraction of outstanding amounts)
+typical_values = {'Current OD Tk.': 5e4, 'Total Current OS Tk.': 1e6, 'Total OD [Excl.NL2] Tk.': 8e4,
+                  'Total OS [Excl.NL2] Tk.': 1.1e6, 'Current Borrowers': 1000, 'Amount Disbursed (Month) Tk.': 5e5,
+                  'General Savings (Month) Tk.': 2e5}
+
+
+# Branchlist with divisions x regions x areas x branches branches, in a shuffled order as in the real file
+def make_branchlist(divisions, regions, areas, branches, rng):
+    rows = []
+    for d in range(divisions):
+        for r in range(regions):
+            for a in range(areas):
+                for b in range(branches):
+                    code = 1000 + len(rows)
+                    rows.append((code, 'Branch {}'.format(code), 'Area {}-{}-{}'.format(d + 1, r + 1, a + 1),
+                                 'Region {}-{}'.format(d + 1, r + 1), 'Division {}'.format(d + 1)))
+    branchlist = pd.DataFrame(rows, columns=['branch_code', 'Branch', 'Area', 'Region', 'Division'])
+    return branchlist.iloc[rng.permutation(len(branchlist))].reset_index(drop=True)
+
+
+# (branches x months) values of one variable
+def make_values(name, n_branches, n_months, rng, zeros, missing):
+    t = np.arange(n_months)
+    season = 1 + 0.1 * np.sin(2 * np.pi * (t + rng.randint(12)) / 12)
+    if name == 'Current OD/OS ratio (Monthly)':
+        values = np.clip(rng.beta(2, 20, (n_branches, 1)) + 0.01 * rng.randn(n_branches, n_months), 0, 1)
+    else:
+        level = rng.lognormal(np.log(typical_values.get(name, 1e5)), 0.5, (n_branches, 1))
+        trend = 1 + rng.normal(0.005, 0.01, (n_branches, 1)) * t[None, :]
+        values = level * np.maximum(trend, 0.1) * season[None, :] * rng.lognormal(0, 0.1, (n_branches, n_months))
+        if name == 'Current Borrowers':
+            values = np.round(values)
+    values[rng.rand(n_branches, n_months) < zeros] = 0
+    values[rng.rand(n_branches, n_months) < missing] = np.nan
+    return values
+
+
+# Write dabi_global.csv and branchlist.csv to out_dir. Returns (branches, variables, months).
+def generate(out_dir, divisions=8, regions=5, areas=6, branches=8, variables=40, months=69, first_month='2012-01',
+             zeros=0.03, missing=0.05, seed=0):
+    rng = np.random.RandomState(seed)
+    branchlist = make_branchlist(divisions, regions, areas, branches, rng)
+    variable_names = (named_variables + ['Variable {}'.format(i + 1) for i in range(variables)])[:variables]
+    month_names = [str(p) for p in pd.period_range(first_month, periods=months, freq='M')]
+
+    # 1% of the branches have no data, and there are as many rows of unknown branches
+    codes = branchlist['branch_code'].values
+    n_unknown = max(len(codes) // 100, 1)
+    codes = np.concatenate([rng.permutation(codes)[n_unknown:], 100000 + np.arange(n_unknown)])
+
+    if not os.path.isdir(out_dir):
+        os.makedirs(out_dir)
+    branchlist.to_csv(os.path.join(out_dir, 'branchlist.csv'), index=False)
+    frames = []
+    for name in variable_names:
+        frame = pd.DataFrame(make_values(name, len(codes), months, rng, zeros, missing), columns=month_names)
+        frame.insert(0, 'variable', name)
+        frame.insert(0, 'branch_code', codes)
+        frames.append(frame)
+    df = pd.concat(frames, ignore_index=True)
+    df.to_csv(os.path.join(out_dir, 'dabi_global.csv'), float_format='%.6g')  # With an index column, as the real one
+    return len(branchlist), len(variable_names), months
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Write a synthetic dabi_global.csv and branchlist.csv.')
+    parser.add_argument('out_dir', help='directory to write the files to')
+    parser.add_argument('--divisions', type=int, default=8)
+    parser.add_argument('--regions', type=int, default=5, help='regions per division')
+    parser.add_argument('--areas', type=int, default=6, help='areas per region')
+    parser.add_argument('--branches', type=int, default=8, help='branches per area')
+    parser.add_argument('--variables', type=int, default=40)
+    parser.add_argument('--months', type=int, default=69)
+    parser.add_argument('--first-month', default='2012-01')
+    parser.add_argument('--zeros', type=float, default=0.03, help='fraction of zero values')
+    parser.add_argument('--missing', type=float, default=0.05, help='fraction of missing values')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args(argv)
+
+    n_branches, n_variables, n_months = generate(
+        args.out_dir, args.divisions, args.regions, args.areas, args.branches, args.variables, args.months,
+        args.first_month, args.zeros, args.missing, args.seed)
+    print('Wrote {} variables for {} branches x {} months to {}'.format(n_variables, n_branches, n_months,
+                                                                         args.out_dir))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
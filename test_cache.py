@@ -0,0 +1,36 @@
+# Tests of cache.py. Run with `python -m pytest` or `python -m unittest test_cache`.
+import shutil
+import tempfile
+import unittest
+
+from cache import DiskCache, key_digest
+
+
+class DiskCacheTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.cache = DiskCache(self.directory)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    # precompute_forecasts.py builds forecast keys from str names (variables.py), the server from the unicode values
+    # of the callbacks, and both have to find the same forecasts
+    def test_str_key_found_with_unicode_key(self):
+        self.cache.set(('arima-hw', ('Division 1', 'Region 1-1'), 'Current Borrowers', 45, 69, 12, '0123abcd'), 'fit')
+        key = (u'arima-hw', (u'Division 1', u'Region 1-1'), u'Current Borrowers', 45, 69, 12, u'0123abcd')
+        self.assertEqual(self.cache.get(key), 'fit')
+        self.assertIn(key, self.cache)
+
+    def test_lists_and_tuples_are_the_same_key(self):
+        self.assertEqual(key_digest(('a', ('b', 1))), key_digest(['a', ['b', 1]]))
+
+    def test_different_keys(self):
+        self.cache.set(('a', 1), 'one')
+        self.assertIsNone(self.cache.get(('a', 2)))
+        self.assertIsNone(self.cache.get(('a', '1')))
+
+
+if __name__ == '__main__':
+    unittest.main()
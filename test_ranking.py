@@ -0,0 +1,41 @@
+# Tests of ranking.py. Run with `python -m pytest` or `python -m unittest test_ranking`.
+import unittest
+
+import numpy as np
+
+from ranking import rank
+
+
+class RankTest(unittest.TestCase):
+
+    def test_higher_is_better(self):
+        ranks, percentile = rank(np.array([[1.], [3.], [2.]]))
+        np.testing.assert_array_equal(ranks[:, 0], [3, 1, 2])
+        np.testing.assert_array_equal(percentile[:, 0], [0, 100, 50])
+
+    def test_lower_is_better(self):
+        ranks, _ = rank(np.array([[1.], [3.], [2.]]), lower_is_better=True)
+        np.testing.assert_array_equal(ranks[:, 0], [1, 3, 2])
+
+    # Tied values share the best of their ranks, whatever their order, and the next value skips the shared ranks
+    def test_ties(self):
+        ranks, percentile = rank(np.array([[2., 5.], [7., 5.], [2., 5.], [1., 3.]]))
+        np.testing.assert_array_equal(ranks, [[2, 1], [1, 1], [2, 1], [4, 4]])
+        np.testing.assert_allclose(percentile[:, 0], [200 / 3., 100, 200 / 3., 0], rtol=1e-6)
+
+    def test_missing_values_are_not_ranked(self):
+        ranks, percentile = rank(np.array([[np.nan], [1.], [2.]]))
+        self.assertTrue(np.isnan(ranks[0, 0]) and np.isnan(percentile[0, 0]))
+        np.testing.assert_array_equal(ranks[1:, 0], [2, 1])
+        np.testing.assert_array_equal(percentile[1:, 0], [0, 100])
+
+    # KPI ranks are computed over (nodes x KPIs x months) slices, i.e. any number of dimensions after the ranked one
+    def test_more_dimensions(self):
+        values = np.random.RandomState(0).rand(5, 3, 4)
+        ranks, _ = rank(values)
+        for k in range(3):
+            np.testing.assert_array_equal(ranks[:, k], rank(values[:, k])[0])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,45 +1,33 @@
 # Callbacks to update time-series graph
-from dash.dependencies import Input, Output
+from dash.dependencies import Input, Output, State
+from dash.exceptions import PreventUpdate
 import plotly.graph_objs as go
 import numpy as np
-from scipy import stats
+import multiprocessing
+import os
 
 from layout import *
 from filter_df import *
-
-import rpy2.robjects.packages as rpackages
-import rpy2.robjects as robjects
-from rpy2.robjects.vectors import StrVector
-
-# Preload/install packages for ARIMA forecasting
-base = rpackages.importr('base')
-utils = rpackages.importr('utils')
-package_names = ('stats', 'forecast')
-names_to_install = [x for x in package_names if not rpackages.isinstalled(x)]
-utils.chooseCRANmirror(ind=1) # select the first mirror in the list
-if len(names_to_install) > 0:
-    utils.install_packages(StrVector(names_to_install))
-stats_r = rpackages.importr('stats')
-forecast = rpackages.importr('forecast')
-
-
-# Define function to make linear predictions. Here, y is an array of response variables, and t is an array of
-# DateTimeIndex objects corresponding to the entries in y.
-def linear_prediction(y, t, forecast_look_back, forecast_look_ahead, name):
-    if not forecast_look_back == 'all':
-        if len(y) > forecast_look_back:
-            y = y[-forecast_look_back:]
-            t = t[-forecast_look_back:]
-    delta_t = (t - pd.to_datetime(t[0])).days.values  # Work in 'number of days since first relevant date'
-    delta_t = np.append(delta_t, delta_t[-1] + [31 * (i + 1) for i in range(forecast_look_ahead)])
-
-    # Fit linear model based on delta_t values
-    gradient, intercept, r_value, p_value, std_err = stats.linregress(delta_t[:len(t)], y)
-    # Make prediction based on delta_t values
-    y_star = [intercept + gradient * i for i in delta_t]
-    # Convert delta_t values to valid dateTimeIndex
-    delta_t = pd.to_timedelta(delta_t, unit='D')
-    t = t[0] + delta_t
+import dataset
+from forecast_worker import ForecastWorker
+from forecasting import look_back_window, forecast_key, forecast_args, arima_forecast
+from trend_index import trend_window
+from memoize import memoize, dont_cache
+from drab_specifier import selected_drabs
+from instrument import stage
+
+# Define function to make linear predictions. The trend of variable for the DRAB node over the last forecast_look_back
+# months of the timeframe is read from the trend index of state, and extended forecast_look_ahead months into the
+# future. Here, t is an array of DateTimeIndex objects corresponding to the months of the timeframe.
+def linear_prediction(state, node, variable, t, timeframe, forecast_look_back, forecast_look_ahead, name):
+    start, stop = trend_window(forecast_look_back, min(timeframe[1], len(state.store.months)), timeframe[0])
+    trend = state.trends.node_trend(variable, node, start, stop)
+    t = t[-(stop - start):]
+
+    # Make prediction for the months of the window and the forecast_look_ahead months after it
+    y_star = trend['intercept'] + trend['slope'] * np.arange(len(t) + forecast_look_ahead)
+    delta_t = pd.to_timedelta([31 * (i + 1) for i in range(forecast_look_ahead)], unit='D')
+    t = t.append(t[-1] + delta_t)
 
     return go.Scatter(x=t,
                       y=y_star,
@@ -48,30 +36,26 @@ def linear_prediction(y, t, forecast_look_back, forecast_look_ahead, name):
                       mode='lines')
 
 
-# Define function for ARIMA prediction. Prediction is based on the 'auto.arima' and 'forecast' functions from the
-# 'forecast' package in R. Interaction with R is through rpy2.
-# This function takes an array y of response variables, and an array t of DateTimeIndex objects. It returns a go.Scatter
-# object corresponding to the ARIMA prediction.
-def arima_prediction(y, t, forecast_look_ahead, name, ci_color):
+# Define function for ARIMA prediction, based on the last forecast_look_back entries of y.
+# This function takes an array y of response variables, and an array t of DateTimeIndex objects. It returns go.Scatter
+# objects corresponding to the ARIMA prediction and its 80% confidence interval. If a cache key is given, the forecast
+# is cached, so the model only has to be fitted once.
+def arima_prediction(y, t, forecast_look_back, forecast_look_ahead, name, ci_color, key=None):
+    y, t = look_back_window(y, t, forecast_look_back)
 
     # Get the necessary DateTimeIndex values for the forecast...
     delta_t = np.append(0, [31 * (i + 1) for i in range(forecast_look_ahead)])  # Day gaps between forecast dates
     delta_t = pd.to_timedelta(delta_t, unit='D')  # Convert to DateTime timedelta object
     t_future = t[-1] + delta_t  # Get future dates by adding delta_t to last observed date in t
 
-    # Import functions required for ARIMA model from R
-    auto_arima = robjects.r('auto.arima')  # auto.arima function from forecast package
-    as_ts = robjects.r('ts')  # time-series class from stats package
-    forecast_fn = robjects.r('forecast')  # forecast function from forecast package
-
-    y_r = robjects.FloatVector(y)  # Define y_r as a float vector copy of y in the R environment
-    y_r = as_ts(y_r, frequency=12)  # Convert y_r to a time-series object
-    arima_model = auto_arima(y_r)  # Fit ARIMA model
-    fc = forecast_fn(arima_model, h=forecast_look_ahead)  # Forecast based on fitted ARIMA model
-
-    mean = np.array(fc.rx2('mean'))  # The mean of the ARIMA forecast
-    upper_80 = [x[0] for x in np.array(fc.rx2('upper'))]  # Upper bound of 80% confidence interval
-    lower_80 = [x[0] for x in np.array(fc.rx2('lower'))]  # Lower bound of 80% confidence interval
+    if key:
+        forecast = arima_worker.request(key, (y, forecast_look_ahead))
+        if forecast is None:
+            dont_cache()  # The graph is incomplete without the forecast
+            return []  # Still being fitted, the traces are added once forecast_status reports it is ready
+        mean, upper_80, lower_80 = forecast
+    else:
+        mean, upper_80, lower_80 = arima_forecast(y, forecast_look_ahead)
 
     traces = [go.Scatter(y=np.append(y[-1],mean),
                          x=t_future,
@@ -104,6 +88,68 @@ def arima_prediction(y, t, forecast_look_ahead, name, ci_color):
     return traces
 
 
+# ARIMA models are fitted in separate worker processes, so that slow fits never block a request (and the R interpreter
+# is never used from several threads). The forecasts of several DRABs (e.g. in the 'Compare many' tab) are fitted in
+# parallel. The number of worker processes (default: up to 4), the fit timeout, the time after which a queued fit
+# nobody is waiting for any more is dropped and the time after which a failed fit is tried again (all in seconds) can be
+# set with environment variables.
+arima_worker = ForecastWorker(arima_forecast, forecast_args,
+                              processes=int(os.environ.get('MF_DASH_FORECAST_PROCESSES',
+                                                           min(multiprocessing.cpu_count(), 4))),
+                              timeout=float(os.environ.get('MF_DASH_FORECAST_TIMEOUT', 120)),
+                              stale_after=float(os.environ.get('MF_DASH_FORECAST_STALE_AFTER', 10)),
+                              retry_after=float(os.environ.get('MF_DASH_FORECAST_RETRY_AFTER', 600)))
+
+
+# Cache keys of the ARIMA forecasts shown for the given selection
+def arima_keys(state, variable, timeframe, drabs, forecast_options, forecast_look_ahead, forecast_look_back):
+    if 'arima_pred' not in forecast_options:
+        return []
+    return [forecast_key('arima', state.resolve(drab), variable, timeframe, forecast_look_back, forecast_look_ahead,
+                         state)
+            for drab in drabs]
+
+
+# Polls whether the ARIMA forecasts of the current selection are still being fitted. The status changes from 'pending'
+# to 'ready' once they are all done, which re-renders the graph with the forecast traces.
+@app.callback(Output('forecast_status', 'children'),
+              [Input('forecast_poll', 'n_intervals'),
+               Input('variable', 'value'),
+               Input('timeframe', 'value'),
+               Input('division', 'value'),
+               Input('region', 'value'),
+               Input('area', 'value'),
+               Input('branch', 'value'),
+               Input('forecast_options', 'values'),
+               Input('drab_tabs', 'value'),
+               Input('division2', 'value'),
+               Input('region2', 'value'),
+               Input('area2', 'value'),
+               Input('branch2', 'value'),
+               Input('forecast_look_ahead', 'value'),
+               Input('forecast_look_back', 'value'),
+               Input('compare_nodes', 'value')],
+              [State('forecast_status', 'children')])
+def update_forecast_status(n_intervals, variable, timeframe, division, region, area, branch, forecast_options,
+                           drab_tabs, division2, region2, area2, branch2, forecast_look_ahead, forecast_look_back,
+                           compare_nodes, forecast_status):
+    drabs = selected_drabs(drab_tabs, [division, region, area, branch], [division2, region2, area2, branch2],
+                           compare_nodes)
+    keys = arima_keys(dataset.state, variable, timeframe, drabs, forecast_options, forecast_look_ahead,
+                      forecast_look_back)
+    status = 'pending' if any([arima_worker.pending(key) for key in keys]) else 'ready'
+    if status == forecast_status:
+        raise PreventUpdate()
+    return status
+
+
+# Polls the forecast status only while forecasts are being fitted
+@app.callback(Output('forecast_poll', 'disabled'),
+              [Input('forecast_status', 'children')])
+def update_forecast_poll(forecast_status):
+    return forecast_status != 'pending'
+
+
 # Updates graph div width depending on whether scatter plot is present
 @app.callback(Output('main_graph_div', 'style'),
               [Input('sec_variable', 'value')])
@@ -123,7 +169,96 @@ def hide_mean_overlay(value):
     else:
         return {'display': 'none'}
 
-# Updates the actual graph
+# The months (start, stop) of the selected timeframe that the trend and forecast are based on, i.e. their look-back
+# window at the end of the timeframe, or None if neither is shown. The series themselves do not depend on the timeframe.
+def series_window(timeframe, forecast_options, forecast_look_back, n_months):
+    if 'linear_pred' not in forecast_options and 'arima_pred' not in forecast_options:
+        return None
+    return list(trend_window(forecast_look_back, min(timeframe[1], n_months), timeframe[0]))
+
+
+def _bounds(values):
+    values = np.asarray(values, dtype=float)
+    if np.isnan(values).all():
+        return None, None
+    return float(np.nanmin(values)), float(np.nanmax(values))
+
+
+# The figure data over all months: the series of the selected DRAB(s) and the mean overlays, and the trend and forecast
+# based on the months of window. Along with the traces ('data'), 'low' and 'high' hold the lowest and highest value of
+# the series in every month, 'forecast_low' and 'forecast_high' the range of the trend and forecast traces and
+# 'forecast_end' the date of their last month, so that update_graph can fit the axes to the selected timeframe.
+@memoize()
+def series_figure(variable, drabs, overlays, forecast_options, forecast_look_ahead, forecast_look_back, window):
+    state = dataset.state  # The same version of the data is used throughout, even if new data is ingested meanwhile
+    t = state.dates
+
+    # Aggregate data at the relevant levels, all in one query
+    with stage('aggregation'):
+        results = query_batch([(drab, [variable], 'mean') for drab in drabs + overlays], state)
+
+    traces = []
+    forecast_traces = []
+    for result in results[:len(drabs)]:
+        node = result['node']
+        name = result['name']
+        y = result['data'].values[0]
+
+        with stage('figure'):
+            traces.append(go.Scatter(
+                x=t,
+                y=y,
+                text=name,
+                name=name,
+                mode='lines+markers'))
+
+        # Forecasting options:
+
+        with stage('forecasting'):
+            predictions = []
+            if 'linear_pred' in forecast_options:
+                predictions.append(linear_prediction(state, node, variable, t[window[0]:window[1]], window,
+                                                     forecast_look_back, forecast_look_ahead, name))
+
+            if 'arima_pred' in forecast_options:
+                key = forecast_key('arima', node, variable, window, forecast_look_back, forecast_look_ahead, state)
+                predictions.extend(arima_prediction(y[window[0]:window[1]], t[window[0]:window[1]],
+                                                    forecast_look_back, forecast_look_ahead, name,
+                                                    'rgba(255, 127, 14, 0.5)', key))
+            traces.extend(predictions)
+            forecast_traces.extend(predictions)
+
+    with stage('figure'):
+        # Global/Divisional/Regional/Area mean option:
+        for result in results[len(drabs):]:
+            traces.append(go.Scatter(
+                x=t,
+                y=result['data'].values[0],
+                text=result['name'],
+                name=result['name'],
+                mode='lines+markers'))
+
+        series = np.array([result['data'].values[0] for result in results], dtype=float).reshape(-1, len(t))
+        low, high = np.full(len(t), np.nan), np.full(len(t), np.nan)
+        months = ~np.isnan(series).all(axis=0)
+        low[months], high[months] = np.nanmin(series[:, months], axis=0), np.nanmax(series[:, months], axis=0)
+        forecast_low, forecast_high = _bounds([np.nan] + [v for trace in forecast_traces for v in trace['y']])
+        forecast_end = None
+        if window and forecast_look_ahead:
+            forecast_end = t[window[1] - 1] + pd.to_timedelta(31 * forecast_look_ahead, unit='D')
+            forecast_end = forecast_end.strftime('%Y-%m-%d')
+
+        return {'data': traces,
+                'low': [None if np.isnan(v) else v for v in low.tolist()],
+                'high': [None if np.isnan(v) else v for v in high.tolist()],
+                'forecast_low': forecast_low,
+                'forecast_high': forecast_high,
+                'forecast_end': forecast_end}
+
+
+# Updates the actual graph. The traces cover all months and are only recomputed when the selection changes (or, with a
+# trend or forecast, when their look-back window does); moving the timeframe slider otherwise just sets the axis ranges
+# to the selected months, so it is served from the memoized series_figure.
 @app.callback(
     Output(component_id='main_graph', component_property='figure'),
     [Input('variable', 'value'),
@@ -140,120 +275,58 @@ def hide_mean_overlay(value):
      Input('area2', 'value'),
      Input('branch2', 'value'),
      Input('forecast_look_ahead', 'value'),
-     Input('forecast_look_back', 'value')])
+     Input('forecast_look_back', 'value'),
+     Input('forecast_status', 'children'),
+     Input('compare_nodes', 'value')])
 def update_graph(variable, timeframe, division, region, area, branch, mean_options, forecast_options,
-                 drab_tabs, division2, region2, area2, branch2, forecast_look_ahead, forecast_look_back):
+                 drab_tabs, division2, region2, area2, branch2, forecast_look_ahead, forecast_look_back,
+                 forecast_status, compare_nodes):
     # Check that we don't have an erroneous division->region->area->branch specification,
     # e.g. division = x1, region = none, area = none, branch = x2
 
-    t = dates
-
-    # Aggregate data at the relevant level
-    df = filter_df([variable], drab=[division, region, area, branch], agg_type='mean')
-    y = df['data'].values[0]
-    name = df['name']
-
-    t = t[timeframe[0]:timeframe[1]]
-    y = y[timeframe[0]:timeframe[1]]
-
-    traces = [go.Scatter(
-        x=t,
-        y=y,
-        text=name,
-        name=name,
-        mode='lines+markers')]
-
-    # Forecasting options:
-
-    if 'linear_pred' in forecast_options:
-        traces.append(linear_prediction(y, t, forecast_look_back, forecast_look_ahead, name))
-
-    if 'arima_pred' in forecast_options:
-        mean, upper_80, lower_80 = arima_prediction(y, t, forecast_look_ahead, name, 'rgba(255, 127, 14, 0.5)')
-        traces.append(mean)
-        traces.append(upper_80)
-        traces.append(lower_80)
-
-    # Compare to another DRAB?
-    if drab_tabs == 2:
-        df = filter_df([variable], drab=[division2, region2, area2, branch2], agg_type='mean')
-        y = df['data'].values[0]
-        name = df['name']
-
-        y = y[timeframe[0]:timeframe[1]]
-
-        traces.append(go.Scatter(
-            x=t,
-            y=y,
-            text=name,
-            name=name,
-            mode='lines+markers'
-        ))
-
-        # Add linear prediction?
-        if 'linear_pred' in forecast_options:
-            traces.append(linear_prediction(y, t, forecast_look_back, forecast_look_ahead, name))
-
-        # Add ARIMA prediction?
-        if 'arima_pred' in forecast_options:
-            mean, upper_80, lower_80 = arima_prediction(y, t, forecast_look_ahead, name, 'rgba(255, 127, 14, 0.5)')
-            traces.append(mean)
-            traces.append(upper_80)
-            traces.append(lower_80)
-
-    # Global/Divisional/Regional/Area mean option:
-    if np.any([i in mean_options for i in ['glbm', 'divm', 'regm', 'arem']]):
-
-        df = df_main[df_main['variable'].isin([variable])]
-
-        # Global mean
-        if 'glbm' in mean_options and division != 'Global':
-            y = df.mean()[1:]
-            traces.append(go.Scatter(
-                x=t,
-                y=y[timeframe[0]:timeframe[1]],
-                text='Global',
-                name='Global',
-                mode='lines+markers'))
-
-        # Divisional mean
-        if 'divm' in mean_options and region and division:
-            y = filter_df([variable], [division, None, None, None], 'mean')['data']
-            y = y.values[0]
-            traces.append(go.Scatter(
-                x=t,
-                y=y[timeframe[0]:timeframe[1]],
-                text=division,
-                name=division,
-                mode='lines+markers'))
-
-        # Regional mean
-        if 'regm' in mean_options and area and region and division:
-            y = filter_df([variable], [division, region, None, None], 'mean')['data']
-            y = y.values[0]
-            traces.append(go.Scatter(
-                x=t,
-                y=y[timeframe[0]:timeframe[1]],
-                text=region,
-                name=region,
-                mode='lines+markers'))
-
-        # Area mean
-        if 'arem' in mean_options and branch and area and region and division:
-            y = filter_df([variable], [division, region, area, None], 'mean')['data']
-            y = y.values[0]
-            traces.append(go.Scatter(
-                x=t,
-                y=y[timeframe[0]:timeframe[1]],
-                text=area,
-                name=area,
-                mode='lines+markers'))
-
-    return {
-        'data': traces,
-        'layout': go.Layout(
-            xaxis={'title': 'Month'},
-            yaxis={'title': variable},
-            margin={'l': 60, 'b': 60, 't': 20, 'r': 20},
-            hovermode='closest')
-    }
\ No newline at end of file
+    t = dataset.state.dates
+
+    # The selected DRAB(s), followed by the DRABs of the Global/Divisional/Regional/Area mean overlays (single mode only)
+    drabs = selected_drabs(drab_tabs, [division, region, area, branch], [division2, region2, area2, branch2],
+                           compare_nodes)
+    overlays = []
+    if drab_tabs != 1:
+        mean_options = []
+    if 'glbm' in mean_options and division != 'Global':
+        overlays.append(['Global', None, None, None])
+    if 'divm' in mean_options and region and division:
+        overlays.append([division, None, None, None])
+    if 'regm' in mean_options and area and region and division:
+        overlays.append([division, region, None, None])
+    if 'arem' in mean_options and branch and area and region and division:
+        overlays.append([division, region, area, None])
+
+    window = series_window(timeframe, forecast_options, forecast_look_back, len(t))
+    if window is None:  # The look-ahead and look-back only matter for the trend and forecast
+        forecast_look_ahead = forecast_look_back = None
+    figure = series_figure(variable, drabs, overlays, sorted(forecast_options), forecast_look_ahead,
+                           forecast_look_back, window)
+
+    with stage('figure'):
+        # Fit the axes to the months of the timeframe (and the trend and forecast after it), with some padding
+        start, stop = timeframe[0], min(timeframe[1], len(t))
+        xaxis = {'title': 'Month'}
+        yaxis = {'title': variable}
+        if start < stop:
+            end = figure['forecast_end'] or t[stop - 1].strftime('%Y-%m-%d')
+            xaxis['range'] = [(t[start] - pd.to_timedelta(15, unit='D')).strftime('%Y-%m-%d'),
+                              (pd.Timestamp(end) + pd.to_timedelta(15, unit='D')).strftime('%Y-%m-%d')]
+            low, high = _bounds(figure['low'][start:stop] + figure['high'][start:stop] +
+                                [figure['forecast_low'], figure['forecast_high']])
+            if low is not None:
+                padding = 0.05 * ((high - low) or abs(high) or 1)
+                yaxis['range'] = [low - padding, high + padding]
+
+        return {
+            'data': figure['data'],
+            'layout': go.Layout(
+                xaxis=xaxis,
+                yaxis=yaxis,
+                margin={'l': 60, 'b': 60, 't': 20, 'r': 20},
+                hovermode='closest')
+        }
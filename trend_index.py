@@ -0,0 +1,85 @@
+# Trend index: the least-squares trend (slope per month, intercept, r^2 and p-value of the slope) of the per-branch mean
+# of every variable, for every DRAB node over a window of months. The trends of all nodes at a level are computed at
+# once with a closed-form batched regression over the (nodes x months) level aggregates (see
+# batch_forecast.linear_fit), skipping missing months, and kept for the lifetime of the store they were computed from.
+# Windows are given as (start, stop) month indices; the standard windows are the last 6, 12 and 24 months and all
+# months of the data.
+from __future__ import division
+
+import numpy as np
+import pandas as pd
+from scipy import stats
+
+from batch_forecast import linear_fit
+from cache import LRUCache
+from drab_tree import drab_levels
+
+standard_look_backs = [6, 12, 24, 'all']
+trend_stats = ['slope', 'intercept', 'r2', 'p_value', 'count']
+
+
+# Month window (start, stop) of the last look_back months (or all months if 'all') up to stop
+def trend_window(look_back, stop, start=0):
+    return (start if look_back == 'all' else max(start, stop - look_back)), stop
+
+
+class TrendIndex(object):
+
+    # maxsize bounds the number of (variable, level, window) entries that are kept
+    def __init__(self, store, maxsize=4096):
+        self.store = store
+        self._trends = LRUCache(maxsize=maxsize)
+
+    # Trend of the per-branch mean of variable over months start:stop for every node at level, as a dict of 1-d arrays
+    # (see trend_stats; the intercept is the trend value at month start), in tree.level_nodes[level] order
+    def level_trends(self, variable, level, start, stop):
+        key = (variable, level, start, stop)
+        trends = self._trends.get(key)
+        if trends is None:
+            values = self.store.level_aggregate(variable, level)['mean'][:, start:stop]
+            slope, intercept, n, _, sxx, rss = linear_fit(values)
+            with np.errstate(invalid='ignore', divide='ignore'):
+                explained = slope ** 2 * sxx
+                r2 = explained / (explained + rss)
+                dof = np.where(n > 2, n - 2, np.nan)
+                t = slope / np.sqrt(rss / dof / sxx)
+                p_value = 2 * stats.t.sf(np.abs(t), dof)
+            trends = {'slope': slope, 'intercept': intercept, 'r2': r2, 'p_value': p_value, 'count': n}
+            for a in trends.values():
+                a.flags.writeable = False
+            self._trends.set(key, trends)
+        return trends
+
+    # Trend of variable for a single node, as a dict of numbers
+    def node_trend(self, variable, node, start, stop):
+        trends = self.level_trends(variable, self.store.tree.level[node], start, stop)
+        i = self.store.tree.level_index[node]
+        return dict((name, trends[name][i]) for name in trend_stats)
+
+    # The count nodes at level with the steepest decline (or rise, if declining is False) of variable over the last
+    # look_back months up to stop (default: the latest month), as a DataFrame indexed by node, steepest first.
+    # Trends with a p-value above max_p_value are left out, e.g.
+    #     trends.steepest('Current Borrowers', 'Branch', 12, count=20)
+    def steepest(self, variable, level, look_back, count=20, declining=True, stop=None, max_p_value=1.):
+        start, stop = trend_window(look_back, len(self.store.months) if stop is None else stop)
+        trends = self.level_trends(variable, level, start, stop)
+        with np.errstate(invalid='ignore'):
+            direction = trends['slope'] < 0 if declining else trends['slope'] > 0  # False for NaN slopes
+            candidates = np.flatnonzero(direction & (trends['p_value'] <= max_p_value))
+        slopes = trends['slope'][candidates]
+        order = candidates[np.argsort(slopes if declining else -slopes, kind='mergesort')[:count]]
+
+        tree = self.store.tree
+        nodes = [tree.level_nodes[level][i] for i in order]
+        df = pd.DataFrame(dict((name, trends[name][order]) for name in trend_stats),
+                          index=pd.Index(nodes, name='node'), columns=trend_stats)
+        df.insert(0, 'name', [tree.name[node] for node in nodes])
+        return df
+
+    # Compute the trends of every variable (default: all) at every level over the standard windows
+    def build(self, variables=None):
+        stop = len(self.store.months)
+        for variable in self.store.variables if variables is None else variables:
+            for level in ['Global'] + drab_levels:
+                for look_back in standard_look_backs:
+                    self.level_trends(variable, level, *trend_window(look_back, stop))
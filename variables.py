@@ -0,0 +1,6 @@
+# Variables the dashboard treats specially by name. This module does not import dash, so that scripts such as
+# precompute_forecasts.py can use it without loading the dashboard.
+
+# Here, we list those variables that we consider 'important', and should be primarily shown in variable selection:
+important_vars = ['Amount Disbursed (Month) Tk.', 'Current Borrowers', 'Current OD/OS ratio (Monthly)',
+                  'General Savings (Month) Tk.', ]